@@ -0,0 +1,53 @@
+# Benchmark of ask
+#
+# Runs a project that asks questions in a loop with scripted answers in this
+# process (run_project(answers=...)), and reports the questions answered per
+# second. Then starts the program of a project with a counting script and a
+# script that asks once, answers it on stdin after a delay and reports how
+# often the counting script ran in the meantime - with a blocking ask it would
+# not run at all.
+#
+# Usage: python3 benchmarks/bench_ask.py [questions] [delay]
+
+import contextlib, io, os, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import convert
+import synthetic
+
+def questions_project(questions):
+    cat = synthetic.sprite("Cat", [synthetic.counting_loop(questions, [["doAsk", "next?"]])],
+                           variables=[("i", 0)])
+    return synthetic.project(sprites=[cat])
+
+def waiting_project():
+    counter = synthetic.sprite("Counter", [
+        [["whenGreenFlag"], ["doUntil", ["=", ["answer"], "done"], [["changeVar:by:", "ticks", 1]]],
+         ["say:", ["readVariable", "ticks"]]]])
+    asker = synthetic.sprite("Asker", [[["whenGreenFlag"], ["doAsk", "done?"]]])
+    return synthetic.project(sprites=[counter, asker], variables=[("ticks", 0)])
+
+def run(questions, delay):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "questions.sb2")
+        synthetic.write_sb2(path, questions_project(questions))
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            convert.run_project(path, answers=["yes"] * questions)
+            elapsed = time.perf_counter() - start
+        print("{:<30} {:>10.0f} questions/s".format("scripted answers", questions / elapsed))
+
+        path = os.path.join(tmp, "waiting.sb2")
+        program = os.path.join(tmp, "waiting.py")
+        synthetic.write_sb2(path, waiting_project())
+        convert.transpile(path, program)
+        process = subprocess.Popen([sys.executable, program, "--headless"], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, text=True)
+        time.sleep(delay)
+        output, _ = process.communicate("done\n")
+        ticks = output.splitlines()[-1].split("'")[1]
+        print("{:<30} {:>10} ticks".format("other script, answer after {}s".format(delay), ticks))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 1.0)
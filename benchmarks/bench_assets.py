@@ -0,0 +1,78 @@
+# Benchmark of sound assets
+#
+# Writes projects with a number of distinct sounds (1 second .wav files each),
+# and measures transpiling them with an assets directory, first empty, then
+# again with the shared directory already holding the sounds. Then measures
+# how long the first playSound: of a sound takes with pygame.mixer, without
+# preloading and once the backend preloaded the sounds in the background.
+#
+# Usage: python3 benchmarks/bench_assets.py [sounds]
+
+import hashlib, io, json, os, sys, tempfile, time, wave, zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import convert
+import synthetic
+
+def wav(seed):
+    "Returns the bytes of a 1 second .wav file, different for every seed"
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(bytes((seed + i) % 256 for i in range(4 * 44100)))
+    return buf.getvalue()
+
+def write_project(path, sounds):
+    "Writes a project with the sounds, returns their md5 names"
+    cat = synthetic.sprite("Cat", [[["whenGreenFlag"], ["playSound:", "sound0"]]])
+    files = [wav(n) for n in range(sounds)]
+    names = [hashlib.md5(data).hexdigest() + ".wav" for data in files]
+    cat["sounds"] = [{"soundName": "sound{}".format(n), "soundID": n, "md5": name}
+                     for n, name in enumerate(names)]
+    with zipfile.ZipFile(path, "w") as f:
+        f.writestr("project.json", json.dumps(synthetic.project(sprites=[cat])))
+        for n, data in enumerate(files):
+            f.writestr("{}.wav".format(n), data)
+    return names
+
+def first_play(runtime, filenames, preload):
+    "Returns the seconds the first play_sound of the last sound takes"
+    backend = runtime.PygameBackend({"audio"})
+    if preload:
+        backend.preload(filenames)
+        while len(backend.loaded_sounds) < len(filenames):
+            time.sleep(0.01)
+    start = time.perf_counter()
+    backend.play_sound(filenames[-1])
+    elapsed = time.perf_counter() - start
+    backend.stop_all_sounds()
+    return elapsed
+
+def run(sounds):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sounds.sb2")
+        assets = os.path.join(tmp, "assets")
+        names = write_project(path, sounds)
+        for label in ("empty assets directory", "shared assets directory"):
+            start = time.perf_counter()
+            convert.transpile(path, os.path.join(tmp, "sounds.py"), assets=assets)
+            print("{:<36} {:>8.1f} ms".format("transpile, " + label, (time.perf_counter() - start) * 1000))
+
+        try:
+            import pygame
+        except ImportError:
+            print("pygame is not installed, not measuring playSound:")
+            return
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        runtime = convert.runtime_module()
+        filenames = [os.path.join(assets, name) for name in names]
+        for preload in (False, True):
+            elapsed = first_play(runtime, filenames, preload)
+            pygame.mixer.quit()
+            print("{:<36} {:>8.2f} ms".format("first play, preloaded" if preload else "first play",
+                                              elapsed * 1000))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,61 @@
+# Benchmark of creating and deleting clones
+#
+# Compiles a project whose sprite has a few variables, a list, a script that
+# runs when it is cloned and one that receives a broadcast, then creates
+# thousands of clones of it (without Scratch's limit of 300) and measures the
+# time per clone and the memory each one takes with tracemalloc, including the
+# Receivers and the coroutine of its when cloned script. Then deletes them.
+#
+# Usage: python3 benchmarks/bench_clones.py [clones]
+
+import os, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import convert
+import synthetic
+
+def clone_project():
+    cat = synthetic.sprite("Cat", [
+        [["whenCloned"], ["changeVar:by:", "x", 1]],
+        [["whenIReceive", "move"], ["changeVar:by:", "y", 1]]],
+        variables=[("x", 0), ("y", 0), ("size", 100)], lists=[("trail", [1, 2, 3])])
+    return synthetic.project(sprites=[cat])
+
+def run(clones):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clones.sb2")
+    synthetic.write_sb2(path, clone_project())
+    try:
+        namespace = {"__name__": "coro_scratch_project"}
+        exec(convert.compile_project(path), namespace)
+    finally:
+        os.remove(path)
+    project = namespace["project"]
+    project.max_clones = clones
+    cat = project.sprite_names["Cat"]
+
+    start = time.perf_counter()
+    for _ in range(clones):
+        project.create_clone(cat)
+    created = time.perf_counter() - start
+    start = time.perf_counter()
+    for clone in list(project.clones):
+        project.delete_clone(clone)
+    deleted = time.perf_counter() - start
+
+    # Measured again, tracemalloc slows down the creation
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for _ in range(clones):
+        project.create_clone(cat)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for clone in list(project.clones):
+        project.delete_clone(clone)
+
+    print("{} clones".format(clones))
+    print("{:<16} {:>8.2f} us".format("create a clone", created / clones * 1e6))
+    print("{:<16} {:>8.2f} us".format("delete a clone", deleted / clones * 1e6))
+    print("{:<16} {:>8.0f} bytes".format("memory a clone", (after - before) / clones))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
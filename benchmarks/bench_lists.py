@@ -0,0 +1,42 @@
+# Benchmark of list blocks on large lists
+#
+# Compares "list contains" and "contents of list" on a plain Python list
+# (how the runtime used to store lists) with ScratchList, for a list of
+# tens of thousands of items that is queried in a loop.
+#
+# Usage: python3 benchmarks/bench_lists.py [items] [queries]
+
+import sys, timeit
+
+from bench_operators import load_runtime
+
+def legacy_contains(l, thing):
+    return str(thing).lower() in [str(item).lower() for item in l]
+
+def legacy_as_string(l):
+    if all([len(item) <= 1 for item in l]):
+        return "".join(map(str, l))
+    else:
+        return " ".join(map(str, l))
+
+def run(items, queries):
+    runtime = load_runtime()
+    contents = ["item {}".format(i) for i in range(items)]
+    plain = list(contents)
+    scratch_list = runtime["ScratchList"](contents)
+    probes = ["ITEM {}".format(i * 7 % (2 * items)) for i in range(queries)]
+
+    results = [
+        ("contains, list", lambda: [legacy_contains(plain, p) for p in probes]),
+        ("contains, ScratchList", lambda: [scratch_list.contains(p) for p in probes]),
+        ("contents, list", lambda: [legacy_as_string(plain) for _ in range(queries)]),
+        ("contents, ScratchList", lambda: [str(scratch_list) for _ in range(queries)]),
+    ]
+    print("{} items, {} queries".format(items, queries))
+    for name, fn in results:
+        elapsed = min(timeit.repeat(fn, number=1, repeat=3))
+        print("{:<24} {:>10.2f}ms".format(name, elapsed * 1000))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 200)
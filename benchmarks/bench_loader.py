@@ -0,0 +1,107 @@
+# Benchmark of loading and transpiling a large .sb2
+#
+# Generates a project with many sprites and scripts, then measures the time
+# and peak memory (tracemalloc) of the loader that wrapped every json node
+# in a JSON_Wrap (kept below for comparison) and of the current loader, both
+# on its own and for a whole transpile.
+#
+# Usage: python3 benchmarks/bench_loader.py [sprites] [scripts per sprite]
+
+import os, sys, tempfile, time, tracemalloc
+import json as json_, zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import convert
+from convert import Block, Costume, List, Sound, Sprite, Variable
+import synthetic
+
+#
+#  The loader before the typed records, kept for comparison
+#
+
+class JSON_Wrap:
+    def __new__(cls, data):
+        if isinstance(data, dict):
+            return super(JSON_Wrap, cls).__new__(cls)
+        elif isinstance(data, list):
+            return [cls(datum) for datum in data]
+        return data
+    def __init__(self, data):
+        self._data = data
+    def __getattr__(self, attr):
+        try:
+            return JSON_Wrap(self._data[attr])
+        except KeyError:
+            raise AttributeError
+
+def legacy_get_json(path):
+    with zipfile.ZipFile(path, 'r') as project:
+        with project.open("project.json", "r") as data:
+            return JSON_Wrap(json_.loads(data.read().decode()))
+
+def legacy_get_stage_and_sprites(json):
+    def convert_block(script):
+        if isinstance(script, list):
+            name, *args = script
+            converted_args = []
+            for arg in args:
+                if isinstance(arg, list) and isinstance(arg[0], list):
+                    converted_args.append([convert_block(sub) for sub in arg])
+                else:
+                    converted_args.append(convert_block(arg))
+            return Block(name, converted_args)
+        return script
+    def convert_object(obj, name, attr_names):
+        attrs = {a: getattr(obj, a, None) for a in attr_names}
+        scripts = [[convert_block(block) for block in script[2]] for script in getattr(obj, "scripts", [])]
+        vars = [Variable(var.name, var.value) for var in getattr(obj, "variables", [])]
+        lists = [List(l.listName, l.contents) for l in getattr(obj, "lists", [])]
+        costumes = [Costume(c.costumeName, c.baseLayerMD5, c.rotationCenterX, c.rotationCenterY,
+                            c.baseLayerID) for c in getattr(obj, "costumes", [])]
+        sounds = [Sound(s.soundName, s.md5) for s in getattr(obj, "sounds", [])]
+        return Sprite(name, attrs, scripts, vars, lists, costumes, sounds)
+    sprites = [convert_object(child, child.objName, convert.sprite_attr_names)
+               for child in json.children if hasattr(child, "objName")]
+    return convert_object(json, "Stage", convert.stage_attr_names), sprites
+
+#
+#  Measurements
+#
+
+def measure(fn):
+    "Returns the time and peak traced memory of fn(), tracing is left out of the time"
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def run(sprites, scripts):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "large.sb2")
+        synthetic.write_sb2(path, synthetic.large_project(sprites, scripts))
+        out = os.path.join(tmp, "large.py")
+
+        def legacy_transpile():
+            json = legacy_get_json(path)
+            objects = legacy_get_stage_and_sprites(json)
+            with open(out, "w") as f:
+                f.write(convert.sprites_to_py(objects, out, convert.watched_names(json._data)))
+
+        cases = [
+            ("load, JSON_Wrap", lambda: legacy_get_stage_and_sprites(legacy_get_json(path))),
+            ("load, records", lambda: convert.get_stage_and_sprites(convert.get_json(path))),
+            ("transpile, JSON_Wrap", legacy_transpile),
+            ("transpile, lazy records", lambda: convert.transpile(path, out)),
+        ]
+        print("{} sprites x {} scripts, {} KiB .sb2".format(sprites, scripts, os.path.getsize(path) // 1024))
+        for name, fn in cases:
+            elapsed, peak = measure(fn)
+            print("{:<24} {:>8.2f}s {:>10.1f} MiB peak".format(name, elapsed, peak / 2**20))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,37 @@
+# Benchmark of repeat loops that only change variables
+#
+# Runs a project counting in a repeat loop that adds a stage variable it never
+# changes, once as it is (the loop yields every 1024 iterations and reads the
+# stage variable once per yield) and once with a script waiting until the
+# counter reaches the end, which makes the loop yield every iteration, and
+# reports the iterations per second of both.
+#
+# Usage: python3 benchmarks/bench_loops.py [iterations]
+
+import contextlib, io, os, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import convert
+import synthetic
+
+def loop_project(iterations, waited):
+    scripts = [synthetic.counting_loop(iterations, [["changeVar:by:", "total", ["readVariable", "step"]]])]
+    if waited:
+        scripts.append([["whenGreenFlag"], ["doWaitUntil", ["=", ["readVariable", "i"], iterations]]])
+    cat = synthetic.sprite("Cat", scripts, variables=[("i", 0), ("total", 0)])
+    return synthetic.project(sprites=[cat], variables=[("step", 3)])
+
+def run(iterations):
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, waited in (("yielding every 1024", False), ("yielding every iteration", True)):
+            path = os.path.join(tmp, "loop.sb2")
+            synthetic.write_sb2(path, loop_project(iterations, waited))
+            with contextlib.redirect_stdout(io.StringIO()):
+                convert.run_project(path, turbo=True, headless=True) # compiled and cached
+                start = time.perf_counter()
+                convert.run_project(path, turbo=True, headless=True)
+                elapsed = time.perf_counter() - start
+            print("{:<26} {:>12.0f} iterations/s".format(label, iterations / elapsed))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
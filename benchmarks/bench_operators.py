@@ -0,0 +1,100 @@
+# Microbenchmark for the Scratch operators in runtime.py
+#
+# Compares the old eval() based convert_and_run_math / convert_and_run_comp with
+# the dispatch table implementation, on the kind of operands a doRepeat or
+# doForever loop feeds them.
+#
+# Usage: python3 benchmarks/bench_operators.py [iterations]
+
+import os, sys, timeit
+
+RUNTIME = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "runtime.py")
+
+def load_runtime():
+    "Executes runtime.py the way a generated program does and returns its namespace"
+    namespace = {"__name__": "runtime"}
+    with open(RUNTIME) as f:
+        exec(compile(f.read(), RUNTIME, "exec"), namespace)
+    return namespace
+
+#
+#  The implementation before the dispatch table, kept for comparison
+#
+
+def legacy_convert_to_num(n):
+    if isinstance(n, (int, float)):
+        return (n, True)
+    try:
+        return int(n), True
+    except ValueError:
+        try:
+            return int(n, base=16), True
+        except ValueError:
+            try:
+                return float(n), True
+            except ValueError:
+                return 0, False
+
+def legacy_convert_and_run_math(op, a, b):
+    num_a, _ = legacy_convert_to_num(a)
+    num_b, _ = legacy_convert_to_num(b)
+    return eval("{} {} {}".format(num_a, op, num_b))
+
+def legacy_convert_and_run_comp(op, a, b):
+    if op == "=":
+        op = "=="
+    num_a, a_is_num = legacy_convert_to_num(a)
+    num_b, b_is_num = legacy_convert_to_num(b)
+    if not a_is_num or not b_is_num:
+        return eval("{} {} {}".format(repr(str(a)), op, repr(str(b))))
+    else:
+        return eval("{} {} {}".format(num_a, op, num_b))
+
+#
+#  Workloads
+#
+
+# (description, op, a, b) - the operands are what variables and literals typically hold
+WORKLOADS = [
+    ("counter + 1", "+", 41, 1),
+    ("float * int", "*", 2.5, 4),
+    ("string - int", "-", "17", 3),
+    ("string / string", "/", "10", "4"),
+    ("int mod int", "%", 17, 5),
+    ("int < int", "<", 3, 7),
+    ("string = int", "=", "42", 42),
+    ("text = text", "=", "apple", "Apple"),
+]
+
+def run(iterations):
+    runtime = load_runtime()
+    math_ops = runtime["math_operators"]
+    print("{:<16} {:>12} {:>12} {:>8}".format("operation", "eval ns/op", "table ns/op", "speedup"))
+    for description, op, a, b in WORKLOADS:
+        if op in math_ops:
+            legacy = lambda: legacy_convert_and_run_math(op, a, b)
+            fn = math_ops[op]
+        else:
+            legacy = lambda: legacy_convert_and_run_comp(op, a, b)
+            fn = runtime["comparison_operators"][op]
+        new = lambda: fn(a, b)
+        before = min(timeit.repeat(legacy, number=iterations, repeat=3)) / iterations * 1e9
+        after = min(timeit.repeat(new, number=iterations, repeat=3)) / iterations * 1e9
+        print("{:<16} {:>12.0f} {:>12.0f} {:>7.1f}x".format(description, before, after, before / after))
+
+    # A tight loop, like "repeat 10000: change counter by (counter mod 7) + 1"
+    def loop(add, mod):
+        counter = 0
+        for _ in range(10000):
+            counter = add(counter, add(mod(counter, 7), 1))
+    number = max(1, iterations // 10000)
+    before = min(timeit.repeat(lambda: loop(lambda a, b: legacy_convert_and_run_math("+", a, b),
+                                            lambda a, b: legacy_convert_and_run_math("%", a, b)),
+                               number=number, repeat=3)) / number
+    after = min(timeit.repeat(lambda: loop(math_ops["+"], math_ops["%"]),
+                              number=number, repeat=3)) / number
+    print("{:<16} {:>11.1f}ms {:>11.1f}ms {:>7.1f}x".format("10000 iter loop", before * 1000,
+                                                          after * 1000, before / after))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,50 @@
+# Benchmark of running many projects in one process
+#
+# Runs copies of a project that waits a number of times in a loop, like
+# animations do, one after another with run_project, concurrently on one
+# event loop with run_projects, and sharded across worker processes.
+# Each project has its own runtime.Project, so they do not share variables,
+# broadcasts or scripts, only the event loop they wait for their frames on.
+#
+# Usage: python3 benchmarks/bench_projects.py [projects] [waits] [jobs]
+
+import contextlib, io, os, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import convert
+import synthetic
+
+def waiting_project(waits):
+    "A project waiting 0.02 seconds waits times"
+    cat = synthetic.sprite("Cat", [synthetic.counting_loop(waits, [["wait:elapsed:from:", 0.02]])],
+                           variables=[("i", 0)])
+    return synthetic.project(sprites=[cat])
+
+def run(projects, waits, jobs):
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(projects):
+            paths.append(os.path.join(tmp, "project{}.sb2".format(i)))
+            synthetic.write_sb2(paths[-1], waiting_project(waits))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for path in paths:
+                convert.run_project(path, turbo=False)
+            sequential = time.perf_counter() - start
+            start = time.perf_counter()
+            convert.run_projects(paths, turbo=False)
+            one_loop = time.perf_counter() - start
+            start = time.perf_counter()
+            convert.run_projects(paths, turbo=False, jobs=jobs)
+            sharded = time.perf_counter() - start
+
+        print("{} projects waiting {} times".format(projects, waits))
+        print("{:<26} {:>8.2f}s".format("one after another", sequential))
+        print("{:<26} {:>8.2f}s".format("concurrently on one loop", one_loop))
+        print("{:<26} {:>8.2f}s".format("sharded on {} processes".format(jobs), sharded))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 4)
@@ -0,0 +1,43 @@
+# Benchmark of running a project repeatedly
+#
+# Runs a small project a number of times the old way, transpiling it to a .py
+# and starting a new interpreter for every run, and with run_project, which
+# compiles it once and then runs the cached code object in this process.
+#
+# Usage: python3 benchmarks/bench_run.py [runs]
+
+import contextlib, io, os, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import convert
+import synthetic
+
+def run(runs):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "project.sb2")
+        out = os.path.join(tmp, "project.py")
+        synthetic.write_sb2(path, synthetic.math_loops(iterations=1000))
+
+        start = time.perf_counter()
+        for _ in range(runs):
+            convert.transpile(path, out)
+            subprocess.run([sys.executable, out, "--turbo", "--headless"], check=True,
+                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        spawned = (time.perf_counter() - start) / runs
+
+        convert.code_cache.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            convert.run_project(path)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(runs):
+                convert.run_project(path)
+            warm = (time.perf_counter() - start) / runs
+
+        print("transpile + new interpreter {:>8.1f} ms per run".format(spawned * 1000))
+        print("run_project, first run      {:>8.1f} ms".format(cold * 1000))
+        print("run_project, cached code    {:>8.1f} ms per run".format(warm * 1000))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
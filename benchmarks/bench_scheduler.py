@@ -0,0 +1,47 @@
+# Loop throughput of the runtime scheduler
+#
+# Runs a number of scripts that each count in a loop, yielding at the end of
+# every iteration, once with an asyncio.sleep(0) per iteration (how generated
+# code used to yield) and once with the frame based Scheduler.
+#
+# Usage: python3 benchmarks/bench_scheduler.py [scripts] [iterations]
+
+import asyncio, sys, time
+
+from bench_operators import load_runtime
+
+def run(scripts, iterations):
+    runtime = load_runtime()
+    YIELD = runtime["YIELD"]
+
+    async def count_sleep():
+        for _ in range(iterations):
+            await asyncio.sleep(0)
+
+    async def count_yield():
+        for _ in range(iterations):
+            await YIELD
+
+    async def gather():
+        await asyncio.gather(*[count_sleep() for _ in range(scripts)])
+
+    start = time.perf_counter()
+    asyncio.run(gather())
+    results = [("asyncio.sleep(0)", time.perf_counter() - start)]
+
+    for turbo in (False, True):
+        scheduler = runtime["Scheduler"](turbo=turbo)
+        for _ in range(scripts):
+            scheduler.start(count_yield())
+        start = time.perf_counter()
+        asyncio.run(scheduler.run())
+        results.append(("Scheduler turbo" if turbo else "Scheduler", time.perf_counter() - start))
+
+    total = scripts * iterations
+    print("{} scripts x {} iterations".format(scripts, iterations))
+    for name, elapsed in results:
+        print("{:<18} {:>8.3f}s {:>12.0f} iterations/s".format(name, elapsed, total / elapsed))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
@@ -0,0 +1,50 @@
+# Benchmark of the startup time of generated programs
+#
+# Transpiles a project with --runtime inline and with --runtime import, then
+# starts each program a number of times and measures the time until its green
+# flag script has said "ready". Programs run as the main script are compiled
+# on every start, so the inlined runtime is compiled each time while the
+# imported one is loaded from its bytecode.
+#
+# Usage: python3 benchmarks/bench_startup.py [runs] [sprites]
+
+import os, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import convert
+import synthetic
+
+def startup_time(program):
+    "Starts program and returns the seconds until it prints its first line"
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy",
+               PYGAME_HIDE_SUPPORT_PROMPT="1")
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, program, "--turbo"], cwd=os.path.dirname(program),
+                               stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, env=env)
+    try:
+        process.stdout.readline()
+        return time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait()
+
+def run(runs, sprites):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "startup.sb2")
+        project = synthetic.large_project(sprites, scripts=1, depth=1)
+        project["children"][0]["scripts"].append([0, 0, [["whenGreenFlag"], ["say:", "ready"]]])
+        synthetic.write_sb2(path, project)
+        convert.install_runtime(tmp)
+        inline = os.path.join(tmp, "inline.py")
+        imported = os.path.join(tmp, "imported.py")
+        convert.transpile(path, inline)
+        convert.transpile(path, imported, runtime="import")
+
+        print("{} sprites, best of {} runs".format(sprites, runs))
+        for name, program in (("inline runtime", inline), ("imported runtime", imported)):
+            best = min(startup_time(program) for _ in range(runs))
+            print("{:<18} {:>8.1f} ms".format(name, best * 1000))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1)
\ No newline at end of file
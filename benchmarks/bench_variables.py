@@ -0,0 +1,52 @@
+# Benchmark of variable access in generated scripts
+#
+# Runs the same variable heavy script, "repeat: change counter by 1, set
+# total to total + counter, set last to counter", with variables accessed by
+# name through runtime_Stage.get_var/set_var/change_var (how generated code
+# used to look) and with the storage the transpiler binds them to now.
+#
+# Usage: python3 benchmarks/bench_variables.py [iterations]
+
+import sys, timeit
+
+from bench_operators import load_runtime
+
+SPRITE = """
+@create_sprite
+class Cat(runtime_Sprite):
+    __slots__ = ('var_counter', 'var_last')
+    my_vars = [('counter', 0), ('last', 0)]
+    my_lists = []
+    my_sounds = []
+    my_attr = {{'objName': 'Cat'}}
+    var_attrs = {{'counter': 'var_counter', 'last': 'var_last'}}
+
+    def by_name(self):
+        for _ in range({n}):
+            self.change_var('counter', 1)
+            self.set_var('total', math_add(self.get_var('total'), self.get_var('counter')))
+            self.set_var('last', self.get_var('counter'))
+
+    def bound(self):
+        for _ in range({n}):
+            self.var_counter = (to_num(self.var_counter) + 1)
+            global_vars['total'] = math_add(global_vars['total'], self.var_counter)
+            self.var_last = self.var_counter
+"""
+
+def run(iterations):
+    runtime = load_runtime()
+    project = runtime["Project"]()
+    runtime.update(project.names())
+    exec(SPRITE.format(n=iterations), runtime)
+    project.global_vars["total"] = 0
+    cat = project.sprites[0]
+    before = min(timeit.repeat(cat.by_name, number=1, repeat=5))
+    after = min(timeit.repeat(cat.bound, number=1, repeat=5))
+    print("{} iterations".format(iterations))
+    print("{:<24} {:>8.1f}ms".format("get_var/set_var by name", before * 1000))
+    print("{:<24} {:>8.1f}ms".format("bound storage", after * 1000))
+    print("{:<24} {:>8.1f}x".format("speedup", before / after))
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,130 @@
+# Benchmark suite of synthetic Scratch projects
+#
+# Generates a .sb2 for every workload below, then measures how long it takes
+# to transpile (and the peak memory of transpiling, with tracemalloc) and how
+# long the generated program runs with --turbo --headless (and its peak RSS).
+# The results are written as JSON, so runs of different versions can be
+# compared with --compare.
+#
+# Usage: python3 benchmarks/suite.py [--repeat N] [--only NAME ...]
+#                                    [--output results.json] [--compare baseline.json]
+
+import argparse, datetime, hashlib, json, os, platform, subprocess, sys, tempfile, time, tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+import convert
+import synthetic
+
+# name -> function returning the project json
+workloads = {
+    "math_loops": synthetic.math_loops,
+    "list_churn": synthetic.list_churn,
+    "broadcast_storm": synthetic.broadcast_storm,
+    "recursion": synthetic.recursion,
+    "recursion_atomic": lambda: synthetic.recursion(atomic=True),
+    "clones": synthetic.clones,
+    "many_sprites": lambda: synthetic.large_project(sprites=100, scripts=10, depth=2),
+}
+
+def version():
+    "Returns the git commit of the tree, or a hash of convert.py and runtime.py outside of git"
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        digest = hashlib.sha256()
+        for name in ("convert.py", "runtime.py"):
+            with open(os.path.join(ROOT, name), "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()[:12]
+
+def measure_transpile(path, out):
+    "Transpiles path to out, returns the seconds it took and the peak of traced memory"
+    tracemalloc.start()
+    start = time.perf_counter()
+    convert.transpile(path, out)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def measure_run(program):
+    "Runs a generated program, returns the seconds it took and its peak RSS in bytes (None if unknown)"
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, program, "--turbo", "--headless"],
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        peak = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    else:
+        process.wait()
+        peak = None
+    elapsed = time.perf_counter() - start
+    if process.returncode:
+        raise RuntimeError("{} exited with {}".format(program, process.returncode))
+    return elapsed, peak
+
+def run(names, repeat):
+    "Measures the workloads in names, each the best of repeat runs"
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            path = os.path.join(tmp, name + ".sb2")
+            out = os.path.join(tmp, name + ".py")
+            synthetic.write_sb2(path, workloads[name]())
+            transpiles = [measure_transpile(path, out) for _ in range(repeat)]
+            runs = [measure_run(out) for _ in range(repeat)]
+            results[name] = {
+                "sb2_bytes": os.path.getsize(path),
+                "py_bytes": os.path.getsize(out),
+                "transpile_seconds": min(t for t, _ in transpiles),
+                "transpile_peak_bytes": min(p for _, p in transpiles),
+                "run_seconds": min(t for t, _ in runs),
+                "run_peak_bytes": min((p for _, p in runs if p is not None), default=None),
+            }
+            print_result(name, results[name])
+    return results
+
+def print_result(name, result, baseline=None):
+    line = "{:<18} transpile {:>8.1f} ms {:>8.1f} MiB   run {:>8.1f} ms {:>8}".format(
+        name, result["transpile_seconds"] * 1000, result["transpile_peak_bytes"] / 2**20,
+        result["run_seconds"] * 1000,
+        "{:.1f} MiB".format(result["run_peak_bytes"] / 2**20) if result["run_peak_bytes"] else "-")
+    if baseline:
+        line += "   {:>5.2f}x / {:>5.2f}x".format(
+            baseline["transpile_seconds"] / result["transpile_seconds"],
+            baseline["run_seconds"] / result["run_seconds"])
+    print(line)
+
+def compare(results, path):
+    "Prints the results next to the speedups over the results in the JSON file at path"
+    with open(path) as f:
+        baseline = json.load(f)
+    print("\nSpeedup over {} (transpile / run):".format(baseline["version"]))
+    for name, result in results["workloads"].items():
+        print_result(name, result, baseline["workloads"].get(name))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs the benchmark suite of synthetic projects")
+    parser.add_argument("--repeat", type=int, default=3, metavar="N",
+                        help="take the best of N runs (default 3)")
+    parser.add_argument("--only", nargs="+", choices=sorted(workloads), metavar="NAME",
+                        help="run these workloads only: {}".format(", ".join(workloads)))
+    parser.add_argument("--output", metavar="JSON", help="write the results to this file")
+    parser.add_argument("--compare", metavar="JSON", help="compare with the results in this file")
+    args = parser.parse_args()
+    results = {
+        "version": version(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "workloads": run(args.only or list(workloads), args.repeat),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,118 @@
+# Generates synthetic Scratch 2.0 projects (.sb2) for the benchmarks
+
+import json, zipfile
+
+def sprite(name, scripts, variables=(), lists=()):
+    "Returns the json of a sprite, scripts are lists of blocks starting with a hat"
+    return {
+        "objName": name,
+        "scripts": [[10, 10 + 100 * i, script] for i, script in enumerate(scripts)],
+        "variables": [{"name": n, "value": v, "isPersistent": False} for n, v in variables],
+        "lists": [{"listName": n, "contents": list(c), "isPersistent": False} for n, c in lists],
+        "costumes": [{"costumeName": "costume1", "baseLayerID": 1,
+                      "baseLayerMD5": "f9a1c175dbe2e5dee472858dd30d16bb.svg",
+                      "rotationCenterX": 47, "rotationCenterY": 55}],
+        "sounds": [],
+        "currentCostumeIndex": 0, "scratchX": 0, "scratchY": 0, "scale": 1,
+        "direction": 90, "rotationStyle": "normal", "isDraggable": False,
+        "indexInLibrary": 1, "visible": True,
+    }
+
+def project(stage_scripts=(), sprites=(), variables=(), lists=()):
+    "Returns the json of a project with the given stage scripts, variables and lists"
+    stage = sprite("Stage", stage_scripts, variables, lists)
+    for attr in ("scratchX", "scratchY", "scale", "direction", "rotationStyle",
+                 "isDraggable", "indexInLibrary", "visible"):
+        del stage[attr]
+    stage["children"] = list(sprites)
+    stage["penLayerMD5"] = "5c81a336fab8be57adc039a8a2b33ca9.png"
+    stage["penLayerID"] = 0
+    stage["tempoBPM"] = 60
+    stage["videoAlpha"] = 0.5
+    return stage
+
+def write_sb2(path, project_json):
+    "Writes the project json to a .sb2 archive at path"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("project.json", json.dumps(project_json))
+
+def math_script(i, depth):
+    "A green flag script doing arithmetic on variables in nested loops"
+    body = [["changeVar:by:", "counter", ["+", ["*", ["readVariable", "counter"], 2], i]],
+            ["setVar:to:", "total", ["-", ["readVariable", "total"], ["%", ["readVariable", "counter"], 7]]]]
+    for level in range(depth):
+        body = [["doRepeat", 3, body],
+                ["doIf", [">", ["readVariable", "counter"], level], [["setVar:to:", "counter", 0]]]]
+    return [["whenGreenFlag"], *body]
+
+def large_project(sprites=200, scripts=20, depth=4):
+    "A project with many sprites, each with many deeply nested scripts"
+    children = [sprite("Sprite{}".format(n),
+                       [math_script(i, depth) for i in range(scripts)],
+                       variables=[("counter", 0)])
+                for n in range(sprites)]
+    return project(sprites=children, variables=[("total", 0)])
+
+def counting_loop(iterations, body):
+    "A green flag script running body in a doRepeat loop, then saying the iteration count"
+    return [["whenGreenFlag"],
+            ["setVar:to:", "i", 0],
+            ["doRepeat", iterations, [["changeVar:by:", "i", 1], *body]],
+            ["say:", ["readVariable", "i"]]]
+
+def math_loops(iterations=200000):
+    "Arithmetic and comparisons on variables in a loop"
+    body = [["setVar:to:", "x", ["+", ["*", ["readVariable", "x"], 3], ["readVariable", "i"]]],
+            ["setVar:to:", "x", ["%", ["readVariable", "x"], 1009]],
+            ["doIf", [">", ["readVariable", "x"], 500], [["changeVar:by:", "big", 1]]]]
+    cat = sprite("Cat", [counting_loop(iterations, body)],
+                 variables=[("i", 0), ("x", 1), ("big", 0)])
+    return project(sprites=[cat])
+
+def list_churn(iterations=50000):
+    "Appends, inserts, replaces, deletes and searches items of a list in a loop"
+    body = [["append:toList:", ["readVariable", "i"], "items"],
+            ["insert:at:ofList:", "x", 1, "items"],
+            ["setLine:ofList:to:", "last", "items", ["concatenate:with:", "y", ["readVariable", "i"]]],
+            ["doIf", ["list:contains:", "items", "x"], [["deleteLine:ofList:", 1, "items"]]],
+            ["doIf", [">", ["lineCountOfList:", "items"], 1000], [["deleteLine:ofList:", "all", "items"]]],
+            ["setVar:to:", "last", ["getLine:ofList:", "random", "items"]]]
+    cat = sprite("Cat", [counting_loop(iterations, body)],
+                 variables=[("i", 0), ("last", "")], lists=[("items", [])])
+    return project(sprites=[cat])
+
+def broadcast_storm(broadcasts=5000, receivers=20):
+    "Many receivers of messages that are broadcast in a tight loop"
+    sender = sprite("Sender", [counting_loop(broadcasts, [["broadcast:", "ping"]]),
+                               [["whenGreenFlag"], ["doBroadcastAndWait", "pong"]]],
+                    variables=[("i", 0)])
+    children = [sender] + [
+        sprite("Receiver{}".format(n),
+               [[["whenIReceive", "ping"], ["changeVar:by:", "received", 1]],
+                [["whenIReceive", "pong"], ["doRepeat", 10, [["changeVar:by:", "received", 1]]]]])
+        for n in range(receivers)]
+    return project(sprites=children, variables=[("received", 0)])
+
+def recursion(depth=17, atomic=False):
+    "A custom block calling itself twice until depth is used up, 2**depth calls"
+    tree = [["procDef", "tree %n", ["depth"], [0], atomic],
+            ["changeVar:by:", "calls", 1],
+            ["doIf", [">", ["getParam", "depth", "r"], 0],
+             [["call", "tree %n", ["-", ["getParam", "depth", "r"], 1]],
+              ["call", "tree %n", ["-", ["getParam", "depth", "r"], 1]]]]]
+    cat = sprite("Cat", [[["whenGreenFlag"], ["call", "tree %n", depth], ["say:", ["readVariable", "calls"]]],
+                         tree],
+                 variables=[("calls", 0)])
+    return project(sprites=[cat])
+
+def clones(count=20000, batch=100):
+    "Clones that count themselves and delete themselves, created batch at a time"
+    cat = sprite("Cat", [
+        [["whenGreenFlag"],
+         ["doRepeat", count // batch, [["doRepeat", batch, [["createCloneOf", "_myself_"]]],
+                                       ["changeVar:by:", "i", 1]]],
+         ["doWaitUntil", ["=", ["readVariable", "done"], count]],
+         ["say:", ["readVariable", "done"]]],
+        [["whenCloned"], ["changeVar:by:", "done", 1], ["deleteClone"]]],
+        variables=[("i", 0), ("x", 0), ("y", 0)], lists=[("trail", [1, 2, 3])])
+    return project(sprites=[cat], variables=[("done", 0)])
@@ -1,31 +1,14 @@
-# Convert a .sb2 into a .py - the .sb2 file is still needed for resources
+# Convert a .sb2 into a .py - the .sb2 file is still needed for resources, unless they are extracted with --assets
 
-import zipfile, tokenize, collections
+import zipfile, tokenize, collections, re, os, sys, hashlib, functools, time, linecache, io, math
+import asyncio, concurrent.futures, importlib.util, py_compile, shutil
 import json as json_
 
-class JSON_Wrap:
-    def __new__(cls, data):
-        if isinstance(data, dict):
-            return super(JSON_Wrap, cls).__new__(cls)
-        elif isinstance(data, list):
-            return [cls(datum) for datum in data]
-        return data
-    def __init__(self, data):
-        self._data = data
-    def __dir__(self):
-        return list(self._data.keys)
-    def __repr__(self):
-        return repr(self._data)
-    def __getattr__(self, attr):
-        try:
-            return JSON_Wrap(self._data[attr])
-        except KeyError:
-            raise AttributeError
-
 Sprite = collections.namedtuple("Sprite", "name attr scripts vars lists costumes sounds")
 Sound = collections.namedtuple("Sound", "name resource")
 Costume = collections.namedtuple("Costume", "name resource cx cy layer")
 Block = collections.namedtuple("Block", "name args")
+ProcDef = collections.namedtuple("ProcDef", "name args defaults atomic")
 Variable = collections.namedtuple("Variable", "name val")
 List = collections.namedtuple("List", "name contents")
 
@@ -33,204 +16,933 @@ def get_json(path):
     "Extracts the json from a .sb2 file"
     with zipfile.ZipFile(path, 'r') as project:
         with project.open("project.json", "r") as data:
-            return JSON_Wrap(json_.loads(data.read().decode()))
-
-def get_stage_and_sprites(json):
-    "Extracts the sprites from json"
-    def convert(script):
-        if isinstance(script, list):
-            name, *args = script
-            converted_args = []
-            for arg in args:
-                if isinstance(arg, list) and isinstance(arg[0], list):
-                    converted_args.append([convert(sub) for sub in arg])
-                else:
-                    converted_args.append(convert(arg))
-            return Block(name, converted_args)
-        return script
-    sprites = []
-    for child in json.children:
-        if hasattr(child, "objName"):
-            name = child.objName.replace(" ","_").replace("!","_").replace("-","_").replace("ø","oe")
-            attr_names = "objName currentCostumeIndex scratchX scratchY scale direction rotationStyle isDraggable indexInLibrary visible".split(' ')
-            attrs = {}
-            for a in attr_names:
-                attrs[a] = getattr(child, a, None)
-
-            scripts = []
-            for script in getattr(child, "scripts", []):
-                script = script[2]
-                if script[0][0] == "procDef":
-                    scripts.append([Block("procDef", JSON_Wrap({"name": script[0][1],
-                                                                "args": script[0][2],
-                                                                "defaults": script[0][3],
-                                                                "atomic": script[0][4]})),
-                                    *[convert(block) for block in script[1:]]])
-                else:
-                    scripts.append([convert(block) for block in script])
-            vars = [Variable(var.name, var.value) for var in getattr(child, "variables", [])]
-            lists = [List(l.listName, l.contents) for l in getattr(child, "lists", [])]
-            costumes = [Costume(c.costumeName, c.baseLayerMD5,
-                c.rotationCenterX, c.rotationCenterY, c.baseLayerID) 
-                for c in getattr(child, "costumes", []) ]
-            sounds = [Sound(s.soundName, s.md5)
-                for s in getattr(child, "sounds", []) ]
-            sprites.append(Sprite(name, attrs, scripts, vars, lists, costumes, sounds))
-        elif hasattr(child, "cmd"):
-            print(f'Ignore cmd {child.cmd}{child.target}.{child.param}')
-        elif hasattr(child, "listName"):
-            print(f'Ignore list {child.listName}: {child.contents}')
+            return json_.load(data)
+
+def convert_block(block):
+    "Converts a block from the json to a Block, recursively"
+    if isinstance(block, list):
+        name, *args = block
+        converted_args = []
+        for arg in args:
+            if isinstance(arg, list) and arg and isinstance(arg[0], list):
+                converted_args.append([convert_block(sub) for sub in arg])
+            else:
+                converted_args.append(convert_block(arg))
+        return Block(name, converted_args)
+    return block
+
+def convert_script(script):
+    "Converts a script from the json, a list of Blocks starting with its hat"
+    blocks = script[2]
+    if blocks[0][0] == "procDef":
+        _, name, args, defaults, atomic = blocks[0]
+        return [Block("procDef", ProcDef(name, args, defaults, atomic)),
+                *[convert_block(block) for block in blocks[1:]]]
+    return [convert_block(block) for block in blocks]
+
+def convert_sprite(obj, name, attr_names):
+    "Converts the json of the stage or a sprite to a Sprite"
+    attrs = {a: obj.get(a) for a in attr_names}
+    scripts = [convert_script(script) for script in obj.get("scripts", [])]
+    vars = [Variable(var["name"], var["value"]) for var in obj.get("variables", [])]
+    lists = [List(l["listName"], l["contents"]) for l in obj.get("lists", [])]
+    costumes = [Costume(c["costumeName"], c["baseLayerMD5"],
+                c.get("rotationCenterX"), c.get("rotationCenterY"), c.get("baseLayerID"))
+                for c in obj.get("costumes", []) ]
+    sounds = [Sound(s["soundName"], s["md5"])
+              for s in obj.get("sounds", []) ]
+    return Sprite(name, attrs, scripts, vars, lists, costumes, sounds)
+
+sprite_attr_names = "objName currentCostumeIndex scratchX scratchY scale direction rotationStyle isDraggable indexInLibrary visible".split(' ')
+stage_attr_names = "objName currentCostumeIndex penLayerMD5 penLayerID tempoBPM videoAlpha".split(' ')
+
+def iter_sprites(json):
+    "Converts the sprites in json one at a time"
+    for child in json.get("children", []):
+        if "objName" in child:
+            name = child["objName"].replace(" ","_").replace("!","_").replace("-","_").replace("ø","oe")
+            yield convert_sprite(child, name, sprite_attr_names)
+        elif "cmd" in child:
+            print(f'Ignore cmd {child["cmd"]}{child.get("target")}.{child.get("param")}')
+        elif "listName" in child:
+            print(f'Ignore list {child["listName"]}: {child.get("contents")}')
         else:
             print('---- Unknown block ----------------------------------------')
             print(child)
-    # Stage
-    attr_names = "objName currentCostumeIndex penLayerMD5 penLayerID tempoBPM videoAlpha".split(' ')
-    attrs = {}
-    for a in attr_names:
-        attrs[a] = getattr(json, a, None)
-    scripts = []
-    for script in getattr(json, "scripts", []):
-        script = script[2]
-        scripts.append([convert(block) for block in script])
-    vars = [Variable(var.name, var.value) for var in getattr(json, "variables", [])]
-    lists = [List(l.listName, l.contents) for l in getattr(json, "lists", [])]
-    costumes = [Costume(c.costumeName, c.baseLayerMD5,
-                c.rotationCenterX, c.rotationCenterY, c.baseLayerID) 
-                for c in getattr(json, "costumes", []) ]
-    sounds =  [Sound(s.soundName, s.md5)
-                for s in getattr(json, "sounds", []) ]
-    stage = Sprite("Stage", attrs, scripts, vars, lists, costumes, sounds)
+
+def get_stage_and_sprites(json, lazy=False):
+    """Extracts the stage and sprites from json
+
+    With lazy=True the sprites are an iterator that converts each sprite when
+    it is reached, so only one sprite's blocks are in memory at a time."""
+    sprites = iter_sprites(json)
+    if not lazy:
+        sprites = list(sprites)
+    stage = convert_sprite(json, "Stage", stage_attr_names)
     return stage, sprites
 
 def indent(amount, code):
     return "\n".join(" "*amount + line for line in code.split("\n"))
 
-# Register of missing features in transpiler
+# Register of missing features in transpiler, reset by transpile
 unknown_block_names = set()
 
-def sprites_to_py(objects, name):
-    "Converts the sprites to a .py file"
-    header = """#! usr/bin/env python3
+def report_unknown_blocks(names, subject="This file uses"):
+    if len(names) > 0:
+        print('{} the following unsupported block names:\n{}'.format(subject, '\n'.join(['    {}'.format(name) for name in sorted(list(names))])))
+
+RUNTIME_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runtime.py")
+# Name programs generated with runtime="import" import the runtime as
+RUNTIME_MODULE = "coro_scratch_runtime"
+
+@functools.lru_cache(maxsize=None)
+def runtime_source():
+    "Returns the text of runtime.py, which is read once per process"
+    with open(RUNTIME_PATH) as f:
+        return f.read()
+
+def install_runtime(directory):
+    """Installs runtime.py as the module imported by programs generated with
+    runtime="import" into directory, together with its compiled bytecode.
+    Returns the path of the module."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, RUNTIME_MODULE + ".py")
+    shutil.copyfile(RUNTIME_PATH, path)
+    py_compile.compile(path, doraise=True)
+    return path
+
+def program_comment(name):
+    "Returns the comment lines a generated program starts with"
+    return """#! usr/bin/env python3
 # -*- coding: latin-1 -*-
 # {}
+""".format(name)
 
-import asyncio, random
-import pygame
+def program_header(name, stage, runtime="inline", messages=(), assets=None):
+    """Returns the start of a generated program, up to the sprite classes. assets
+    is the directory its sounds and costumes were extracted to, see extract_assets"""
+    header = program_comment(name)
+    global_vars = repr(dict(stage.vars))
+    global_lists = "{{{}}}".format(", ".join("{!r}: ScratchList({!r})".format(*l) for l in stage.lists))
+    if runtime == "import":
+        header += "\nimport asyncio, random, sys\nfrom {} import *\n".format(RUNTIME_MODULE)
+    else:
+        header += "\n{}\n".format(runtime_source())
+    header += "\nproject = Project()\nglobals().update(project.names())\n"
+    if assets:
+        header += "project.assets = {!r}\n".format(assets)
+    header += "global_vars.update({})\n".format(global_vars)
+    header += "global_lists.update({})\n".format(global_lists)
+    header += "define_messages({!r})\n\n".format(list(messages))
+    return header
 
-loop = asyncio.get_event_loop()
-""".format(name)
+def program_footer(subsystems=(), profile=False):
+    """Returns the end of a generated program: run, a coroutine that runs the
+    project on the event loop it is awaited on, and main, which runs it on its
+    own loop when the program is the main script, and exits with status 1 if
+    a script failed"""
+    return """
 
-    footer = """
+async def run(turbo=False, headless=False, answers=None):
+    use_backend({!r}, headless, answers){}
+    await project.run(turbo)
 
-def main():
-    broadcast(GREENFLAG)
-    tasks = asyncio.all_tasks()
-    loop.run_until_complete(asyncio.gather(*tasks))
-    loop.close()
+def main(argv=None):
+    argv = sys.argv if argv is None else argv
+    try:
+        asyncio.run(run("--turbo" in argv, "--headless" in argv, read_answers(argv)))
+    except Exception as e:
+        if e is not project.scheduler.error:
+            raise
+        sys.exit(1) # the traceback was printed when the script failed
 
-main()"""
+if __name__ == '__main__':
+    main()""".format(sorted(subsystems), "\n    enable_profile()" if profile else "")
 
+def sprites_to_py(objects, name, watched, cache=None, runtime="inline", subsystems=(), messages=(),
+                  profile=False, warp_limit=None, assets=None):
+    """Converts the sprites to a .py file, watched are the names read by
+    doWaitUntil conditions (see watched_names). Scripts found in the
+    TranspileCache cache are not converted again. With runtime="inline" the
+    runtime is pasted into the file, with runtime="import" it is imported
+    from the module installed by install_runtime. subsystems are the pygame
+    subsystems the program uses (see used_subsystems), without any it runs
+    headless. messages are the names of the broadcasts in the project (see
+    message_names). With profile every script is instrumented, and the program
+    prints their profile when it exits. warp_limit is passed on to enter_scope.
+    assets is the directory the program finds its sounds in, see extract_assets."""
     stage, sprites = objects
-    global_vars = repr(dict(stage.vars))
-    global_lists = repr(dict(stage.lists))
-    header += "\nglobal_vars = {}\n".format(global_vars)
-    header += "global_lists = {}\n".format(global_lists)
-    header += "\n{}\n".format(open("runtime.py").read())
-    converted_stage = convert_object("Stage", stage)
-    converted_sprites = [convert_object("Sprite", sprite) for sprite in sprites]
-    if len(unknown_block_names) > 0:
-        print('This file uses the following unsupported block names:\n{}'.format('\n'.join(['    {}'.format(name) for name in sorted(list(unknown_block_names))])))
-    return header + "{}\n\n".format(converted_stage) + '\n\n'.join(converted_sprites) + footer
-
-def convert_object(type_, sprite):
-    "Converts the sprite to a class"
-    class_template = """@create_sprite
-class {}(runtime_{}):
-    my_vars = {}
-    my_lists = {}
-    my_sounds = {}
-    my_costumes = {}
-    my_attr = {}
-{}"""
-    custom_template = """async def {}(self, {}):
-{}"""
+    header = program_header(name, stage, runtime, messages, assets)
+    slots = {message: slot for slot, message in enumerate(messages, 1)}
+    converted_stage = convert_object("Stage", stage, stage, watched, slots, cache, profile, warp_limit)
+    converted_sprites = [convert_object("Sprite", sprite, stage, watched, slots, cache, profile, warp_limit)
+                         for sprite in sprites]
+    return (header + "{}\n\n".format(converted_stage) + '\n\n'.join(converted_sprites)
+            + program_footer(subsystems, profile))
+
+# A function of a sprite class: the decorators (without @) and parameters
+# (name, default) of its def, whether it is a plain function instead of a
+# coroutine, whether it is an atomic custom block and the blocks of its body
+Function = collections.namedtuple("Function", "decorators name params sync atomic blocks")
+
+def enter_scope(sprite, stage, watched, messages, profile=False, warp_limit=None):
+    """Sets the scope for converting the scripts of sprite, messages maps the
+    broadcasts to their listener slots. With profile the scripts are
+    instrumented for the runtime profiler.
+
+    Atomic custom blocks ("run without screen refresh") that never wait become
+    plain functions. With a warp_limit in seconds they stay coroutines instead,
+    and their loops yield once the frame took longer than that, like Scratch."""
+    global scope
+    global_vars = set(var.name for var in stage.vars)
+    global_lists = set(l.name for l in stage.lists)
+    reserved = reserved_attrs(sprite)
+    local_vars = storage_attrs([v.name for v in sprite.vars if v.name not in global_vars], "var_", reserved)
+    local_lists = storage_attrs([l.name for l in sprite.lists if l.name not in global_lists], "list_",
+                                reserved | set(local_vars.values()))
+    scope = Scope(global_vars, global_lists, local_vars, local_lists,
+                  watched, messages, profile,
+                  sync_procedures(sprite.scripts) if warp_limit is None else {},
+                  warp_limit, False, 0, False, {}, None)
+
+def sprite_functions(sprite):
+    "Returns the Functions the scripts of the sprite become, in the current scope"
     funcs = []
     greenflags = 0
     slots = 0
+    clone_scripts = 0
     for script in sprite.scripts:
         hat, *blocks = script
         if hat.name == "whenGreenFlag":
             greenflags += 1
-            func_name = f"greenflag{greenflags}"
-            func_body = indent(4, convert_blocks(blocks))
-            func_def = f'@on_broadcast(GREENFLAG)\nasync def {func_name}(self):\n{func_body}'
-            funcs.append(func_def)
+            func = Function(["on_broadcast(GREENFLAG)"], f"greenflag{greenflags}", [], False, False, blocks)
         elif hat.name == "procDef":
-            block_name = hat.args.name.replace("%", "").replace(" ", "_")
-            args = list(zip(hat.args.args, hat.args.defaults))
-            args = ", ".join("{}={}".format(name, default) for (name, default) in args)
-            body = indent(4, convert_blocks(blocks))
-            funcs.append(custom_template.format(block_name, args, body))
+            block_name = procedure_name(hat.args.name)
+            func = Function([], block_name, list(zip(hat.args.args, hat.args.defaults)),
+                            hat.args.name in scope.sync_procs, bool(hat.args.atomic), blocks)
         elif hat.name == "whenIReceive":
             event_name = hat.args[0]
             slots += 1
-            func_name = f"slot{slots}"
-            func_body = indent(4, convert_blocks(blocks))
-            func_def = f'@on_broadcast("{event_name}")\nasync def {func_name}(self):\n{func_body}'
-            funcs.append(func_def)
+            func = Function([f"on_broadcast({scope.messages[event_name]}) # {event_name!r}"],
+                            f"slot{slots}", [], False, False, blocks)
+        elif hat.name == "whenCloned":
+            clone_scripts += 1
+            func = Function(["on_broadcast(CLONED)"], f"cloned{clone_scripts}", [], False, False, blocks)
         else:
             print(f'Unknown hat "{hat.name}"')
-    return class_template.format(sprite.name,
-                                 type_,
-                                 repr([tuple(v) for v in sprite.vars]),
-                                 repr([tuple(l) for l in sprite.lists]),
-                                 repr([tuple(s) for s in sprite.sounds]),
-                                 repr([tuple(c) for c in sprite.costumes]),
-                                 repr(sprite.attr),
-                                 indent(4, ("\n\n".join(funcs) if funcs else "pass")))
+            continue
+        if scope.profile:
+            func.decorators.append("profiled({!r}, {!r})".format(sprite.name, func.name))
+        funcs.append(func)
+    return funcs
+
+def function_header(func):
+    "Returns the decorators and the def line of a Function"
+    params = "".join(", {}={!r}".format(name, default) for name, default in func.params)
+    return "".join("@{}\n".format(d) for d in func.decorators) + "{}def {}(self{}):".format(
+        "" if func.sync else "async ", func.name, params)
+
+def class_header(type_, sprite):
+    "Returns the class statement of the sprite with its attributes, in the current scope"
+    return """@create_sprite
+class {}(runtime_{}):
+    __slots__ = {}
+    my_vars = {}
+    my_lists = {}
+    my_sounds = {}
+    my_costumes = {}
+    my_attr = {}
+    var_attrs = {}
+    list_attrs = {}""".format(sprite.name,
+                              type_,
+                              repr((*scope.local_vars.values(), *scope.local_lists.values())),
+                              repr([tuple(v) for v in sprite.vars]),
+                              repr([tuple(l) for l in sprite.lists]),
+                              repr([tuple(s) for s in sprite.sounds]),
+                              repr([tuple(c) for c in sprite.costumes]),
+                              repr(sprite.attr),
+                              repr(scope.local_vars),
+                              repr(scope.local_lists))
+
+def convert_object(type_, sprite, stage, watched, messages, cache=None, profile=False, warp_limit=None):
+    "Converts the sprite to a class, the other arguments are those of enter_scope"
+    global scope
+    enter_scope(sprite, stage, watched, messages, profile, warp_limit)
+    funcs = []
+    for func in sprite_functions(sprite):
+        scope = scope._replace(atomic=func.atomic, script="{}.{}".format(sprite.name, func.name))
+        body = convert_body(func.blocks, cache, fingerprint(scope) if cache else None)
+        funcs.append("{}\n{}".format(function_header(func), body))
+    scope = scope._replace(atomic=False, script=None)
+    return "{}\n{}".format(class_header(type_, sprite), indent(4, ("\n\n".join(funcs) if funcs else "pass")))
+
+def convert_body(blocks, cache=None, context=None):
+    """Converts the blocks of a script to the indented body of its function,
+    context is the fingerprint of the scope for the cache key"""
+    global unknown_block_names
+    if cache is None:
+        return indent(4, convert_blocks(fold_constants(blocks)))
+    key = cache.key(context, repr(blocks))
+    entry = cache.get(key)
+    if entry is None:
+        # Collect the unknown blocks of this script on their own, so the cache entry has them all
+        outer_names, unknown_block_names = unknown_block_names, set()
+        try:
+            entry = {"code": indent(4, convert_blocks(fold_constants(blocks))),
+                     "unknown": sorted(unknown_block_names)}
+        finally:
+            unknown_block_names = outer_names | unknown_block_names
+        cache.put(key, entry)
+    unknown_block_names.update(entry["unknown"])
+    return entry["code"]
+
+#
+#  Variable and list storage
+#
+
+Scope = collections.namedtuple("Scope", "global_vars global_lists local_vars local_lists watched messages profile "
+                                        "sync_procs warp_limit atomic loop_depth counted hoisted script")
+
+# Where the variables and lists of the sprite being converted are stored, set by convert_object.
+# Stage variables and lists live in the global_vars and global_lists dicts, those of a
+# sprite in attributes of the sprite. watched are the names read by doWaitUntil conditions,
+# messages maps the broadcasts of the project to their listener slots, profile is set
+# when loops count their iterations for the runtime profiler. sync_procs maps the custom
+# blocks of the sprite that are plain functions to the names of the variables and lists
+# they change (including in the custom blocks they call), atomic is set while converting the body
+# of an atomic custom block, whose loops yield only after warp_limit seconds (if given).
+# loop_depth is the number of tight loops (see tight_loop) around the blocks being
+# converted, counted is set if their iterations are counted to yield every batch, hoisted maps the variables they read into locals to (raw local, number local).
+# script is "sprite.function" of the script being converted, for the comments of its lines.
+scope = Scope(set(), set(), {}, {}, set(), {}, False, {}, None, False, 0, False, {}, None)
+
+# Attributes the class statement of a sprite defines, see class_header
+class_attrs = {"__slots__", "my_vars", "my_lists", "my_sounds", "my_costumes", "my_attr", "var_attrs", "list_attrs"}
+
+def procedure_name(name):
+    "Returns the name of the method a custom block becomes"
+    return name.replace("%", "").replace(" ", "_")
+
+def reserved_attrs(sprite):
+    """Returns the attribute names the variables and lists of the sprite can't be
+    stored in: those of its runtime base class, its class statement and its methods"""
+    return (set(dir(runtime_module().runtime_Sprite)) | class_attrs |
+            {procedure_name(hat.args.name) for hat, *_ in sprite.scripts if hat.name == "procDef"})
+
+def storage_attrs(names, prefix, reserved=frozenset()):
+    "Maps Scratch names to unique Python attribute names, none of them in reserved"
+    attrs = {}
+    for name in names:
+        attr = prefix + re.sub(r"[^0-9a-zA-Z_]", "_", name)
+        while attr in attrs.values() or attr in reserved:
+            attr += "_"
+        attrs[name] = attr
+    return attrs
+
+def var_storage(name):
+    "Returns the Python expression a variable is stored in, None if it is looked up at runtime"
+    if not isinstance(name, str):
+        return None
+    if name in scope.global_vars:
+        return "global_vars[{!r}]".format(name)
+    if name in scope.local_vars:
+        return "self." + scope.local_vars[name]
+    return None
+
+def list_storage(name):
+    "Returns the Python expression for a list"
+    if isinstance(name, str) and name in scope.global_lists:
+        return "global_lists[{!r}]".format(name)
+    if isinstance(name, str) and name in scope.local_lists:
+        return "self." + scope.local_lists[name]
+    return "self._get_list({})".format(convert_reporters(name))
+
+def notify(name):
+    "Returns the line that wakes doWaitUntil scripts after name changed, if any are waiting for it"
+    if isinstance(name, str) and name in scope.watched:
+        return "\nnotify_change({!r})".format(name)
+    return ""
+
+def watched_names(json):
+    "Returns the names read by the doWaitUntil conditions in the project json"
+    def walk(item):
+        if isinstance(item, list):
+            if item and item[0] == "doWaitUntil" and len(item) > 1:
+                names.update(condition_dependencies(convert_block(item[1])) or ())
+            for sub in item:
+                walk(sub)
+    names = set()
+    for obj in [json] + json.get("children", []):
+        walk(obj.get("scripts", []))
+    return names
+
+def broadcast_line(template, message):
+    "Formats template with the listener slot of message, which is looked up at runtime if it is not a literal"
+    if isinstance(message, str) and message in scope.messages:
+        return template.format(scope.messages[message]) + " # {!r}".format(message)
+    return template.format("message_slot({})".format(convert_reporters(message)))
+
+def message_names(json):
+    "Returns the names of the messages received or broadcast by name in the project json"
+    def walk(item):
+        if isinstance(item, list):
+            if (len(item) > 1 and item[0] in ("whenIReceive", "broadcast:", "doBroadcastAndWait")
+            and isinstance(item[1], str)):
+                names.add(item[1])
+            for sub in item:
+                walk(sub)
+    names = set()
+    for obj in [json] + json.get("children", []):
+        walk(obj.get("scripts", []))
+    return sorted(names)
+
+# Blocks that need a pygame subsystem, the rest of the runtime works headless
+subsystem_blocks = {"keyPressed:": "keys", "playSound:": "audio", "stopAllSounds": "audio"}
+
+def used_subsystems(json):
+    "Returns the pygame subsystems, 'keys' and 'audio', that the blocks of the project json use"
+    def walk(item):
+        if isinstance(item, list):
+            if item and isinstance(item[0], str) and item[0] in subsystem_blocks:
+                subsystems.add(subsystem_blocks[item[0]])
+            for sub in item:
+                walk(sub)
+    subsystems = set()
+    for obj in [json] + json.get("children", []):
+        walk(obj.get("scripts", []))
+    return subsystems
+
+#
+#  Assets
+#
+
+# md5 names of assets in project.json, e.g. 83a9787d4cb6f3b7632b4ddfebf74367.wav
+asset_name = re.compile(r"[0-9a-f]{32}\.\w+")
+
+def default_asset_dir():
+    "Returns the directory used by --assets when no directory is given, next to the --cache one"
+    return default_cache_dir() + "-assets"
+
+def project_assets(json):
+    """Returns the (id, md5 name) of the sounds, costumes and pen layer in the
+    project json. The .sb2 stores each asset as its id with the extension of
+    its md5 name, e.g. 0.wav."""
+    assets = [(json.get("penLayerID"), json.get("penLayerMD5"))]
+    for obj in [json] + json.get("children", []):
+        for costume in obj.get("costumes", []):
+            assets.append((costume.get("baseLayerID"), costume.get("baseLayerMD5")))
+            assets.append((costume.get("textLayerID"), costume.get("textLayerMD5")))
+        for sound in obj.get("sounds", []):
+            assets.append((sound.get("soundID"), sound.get("md5")))
+    return [(id_, md5) for id_, md5 in assets
+            if isinstance(id_, int) and isinstance(md5, str) and asset_name.fullmatch(md5)]
+
+def extract_assets(in_, json, directory):
+    """Extracts the assets of the .sb2 file at in_ into directory, named by
+    their md5 - the directory is content-addressed, so projects can share it.
+    Assets that are there already are not extracted again, assets missing
+    from the file are skipped. Returns the number of files extracted."""
+    os.makedirs(directory, exist_ok=True)
+    extracted = 0
+    with zipfile.ZipFile(in_) as project:
+        members = set(project.namelist())
+        for id_, md5 in project_assets(json):
+            path = os.path.join(directory, md5)
+            member = "{}{}".format(id_, os.path.splitext(md5)[1])
+            if member not in members or os.path.exists(path):
+                continue
+            # Write to a file of our own first, so programs and batch workers never see half an asset
+            temp = "{}.{}.tmp".format(path, os.getpid())
+            with project.open(member) as source, open(temp, "wb") as f:
+                shutil.copyfileobj(source, f)
+            os.replace(temp, path)
+            extracted += 1
+    return extracted
+
+#
+#  Compile-time optimizations
+#
+
+# Runtime functions implementing the Scratch operators, see math_operators in runtime.py
+math_functions = {"+": "math_add", "-": "math_sub", "*": "math_mul", "/": "math_div", "%": "math_mod"}
+comparison_functions = {"=": "comp_eq", "<": "comp_lt", ">": "comp_gt"}
+
+# Literals that are unambiguously numbers, anything else is left to convert_to_num at runtime
+number_literal = re.compile(r"-?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?")
+
+def literal_to_num(value):
+    """Returns the number a literal stands for, or None if it is not plainly a
+    finite number (infinite and NaN values are left to the runtime)"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and number_literal.fullmatch(value):
+        try:
+            value = int(value)
+        except ValueError:
+            value = float(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value == value and abs(value) != float("inf"):
+        return value
+    return None
+
+def fold_math(op, a, b):
+    "Computes a math block with number literal operands, None if it must be left to the runtime"
+    if op == "+":
+        return a + b
+    elif op == "-":
+        return a - b
+    elif op == "*":
+        return a * b
+    elif op == "/" and b != 0:
+        return a / b
+    elif op == "%" and b != 0:
+        return a % b
+    return None
+
+def fold_constants(block):
+    """Folds constant subexpressions of a block, a list of blocks or a literal
+
+    Operands of math blocks that are number literals become numbers, so
+    convert_reporters knows their type."""
+    if isinstance(block, list):
+        return [fold_constants(b) for b in block]
+    if not isinstance(block, Block) or not isinstance(block.args, list):
+        return block
+    args = [fold_constants(arg) for arg in block.args]
+    if block.name in math_functions:
+        nums = [literal_to_num(arg) if not isinstance(arg, Block) else None for arg in args]
+        if None not in nums:
+            result = fold_math(block.name, *nums)
+            if result is not None and result == result and abs(result) != float("inf"):
+                return result
+        args = [arg if num is None else num for arg, num in zip(args, nums)]
+    elif block.name in comparison_functions:
+        a, b = args
+        num_a, num_b = literal_to_num(a), literal_to_num(b)
+        if num_a is not None and num_b is not None:
+            return {"=": num_a == num_b, "<": num_a < num_b, ">": num_a > num_b}[block.name]
+    elif block.name == "concatenate:with:":
+        if all(isinstance(arg, str) or type(arg) is int for arg in args):
+            return "".join(map(str, args))
+    elif block.name == "not" and isinstance(args[0], bool):
+        return not args[0]
+    return Block(block.name, args)
+
+def is_number(block):
+    "True if the reporter is known to evaluate to a Python int or float"
+    if isinstance(block, bool):
+        return False
+    if isinstance(block, (int, float)):
+        return True
+    if isinstance(block, Block):
+        return (block.name in math_functions
+                or block.name == "lineCountOfList:"
+                or block.name == "randomFrom:to:")
+    return False
+
+def convert_number(block):
+    "Converts a reporter used where a number is needed, coercing only if the type is unknown"
+    if not isinstance(block, Block) and literal_to_num(block) is not None:
+        return repr(literal_to_num(block))
+    if is_number(block):
+        return convert_reporters(block)
+    if isinstance(block, Block) and block.name == "readVariable" and block.args[0] in scope.hoisted:
+        return scope.hoisted[block.args[0]][1]
+    return "to_num({})".format(convert_reporters(block))
+
+def convert_math(block):
+    "Converts a math block to Python arithmetic, or to the runtime helper when operands may not be numbers"
+    a, b = block.args
+    op = block.name
+    if op in ("/", "%") and not (is_number(b) and not isinstance(b, Block) and b != 0):
+        # Division by zero gives Infinity/NaN in Scratch, only the helpers handle that
+        return "{}({}, {})".format(math_functions[op], convert_reporters(a), convert_reporters(b))
+    if not is_number(a) and not is_number(b):
+        return "{}({}, {})".format(math_functions[op], convert_reporters(a), convert_reporters(b))
+    return "({} {} {})".format(convert_number(a), op, convert_number(b))
+
+def convert_comparison(block):
+    "Converts a comparison block, comparing directly when both sides are numbers"
+    a, b = block.args
+    if is_number(a) and is_number(b):
+        op = {"=": "==", "<": "<", ">": ">"}[block.name]
+        return "({} {} {})".format(convert_reporters(a), op, convert_reporters(b))
+    return "{}({}, {})".format(comparison_functions[block.name],
+                               convert_reporters(a),
+                               convert_reporters(b))
+
+def convert_random(block):
+    "Converts pick random, calling the random module directly for number literals"
+    a, b = block.args
+    if type(a) is int and type(b) is int:
+        return "random.randint({}, {})".format(min(a, b), max(a, b))
+    if is_number(a) and is_number(b) and not isinstance(a, Block) and not isinstance(b, Block):
+        return "random.uniform({}, {})".format(a, b)
+    return "pick_random({}, {})".format(convert_reporters(a), convert_reporters(b))
+
+# Reporters whose value only depends on their arguments
+pure_reporters = {"&", "|", "not", "concatenate:with:"} | set(math_functions) | set(comparison_functions)
+# Position of the list name in list reporters
+list_reporters = {"contentsOfList:": 0, "lineCountOfList:": 0, "list:contains:": 0, "getLine:ofList:": 1}
+
+# Name notify_change uses for the answer of ask, the same as in runtime.py
+ANSWER = '\x06'
+
+def condition_dependencies(block):
+    """Returns the names of the variables and lists a condition reads, and
+    ANSWER if it reads the answer of ask. Returns None if it depends on
+    something the runtime can not watch, like keys or random numbers."""
+    if not isinstance(block, Block):
+        return set()
+    names = set()
+    if block.name == "readVariable" or block.name in list_reporters:
+        name = block.args[list_reporters.get(block.name, 0)]
+        if not isinstance(name, str):
+            return None
+        names.add(name)
+    elif block.name == "answer":
+        names.add(ANSWER)
+    elif block.name == "getParam":
+        return names
+    elif block.name not in pure_reporters:
+        return None
+    for arg in block.args:
+        arg_names = condition_dependencies(arg)
+        if arg_names is None:
+            return None
+        names |= arg_names
+    return names
+
+def convert_count(block):
+    "Converts the count of a repeat block, which Scratch rounds to a whole number (halves up)"
+    if not isinstance(block, Block) and literal_to_num(block) is not None:
+        return repr(math.floor(literal_to_num(block) + 0.5))
+    return "repeat_count({})".format(convert_number(block))
+
+def loop_yield():
+    "Returns the end of a loop iteration, which yields unless the loop is in an atomic custom block"
+    if not scope.atomic:
+        return "await YIELD"
+    if scope.warp_limit is not None:
+        return "if warp_expired({!r}):\n    await YIELD".format(scope.warp_limit)
+    return ""
+
+def loop_body(blocks):
+    "Converts the blocks inside a loop to its indented body, counting the iterations when profiling"
+    body = convert_blocks(blocks)
+    if scope.profile:
+        body = "count_loop()\n" + body
+    if loop_yield():
+        body += "\n" + loop_yield()
+    return indent(4, body)
+
+# Blocks a tight loop may contain: they neither wait nor start other scripts
+tight_blocks = {"setVar:to:", "changeVar:by:", "doIf", "doIfElse", "doRepeat", "call",
+                "append:toList:", "deleteLine:ofList:", "insert:at:ofList:", "setLine:ofList:to:"}
+# Position of the name of the variable or list these blocks change
+changed_name = {"setVar:to:": 0, "changeVar:by:": 0, "append:toList:": 1, "deleteLine:ofList:": 1,
+                "insert:at:ofList:": 2, "setLine:ofList:to:": 1}
+# Iterations of a tight loop between yields, a power of 2
+tight_loop_batch = 1024
+
+def is_tight(blocks):
+    """True if a loop over blocks can run many iterations per yield: they only
+    change variables and lists no doWaitUntil waits for, call custom blocks
+    that are plain functions and change none of those either, and contain
+    only such loops"""
+    for block in blocks or ():
+        if block.name not in tight_blocks:
+            return False
+        if block.name == "call" and (block.args[0] not in scope.sync_procs or
+                                     scope.sync_procs[block.args[0]] & scope.watched):
+            return False
+        if block.name in changed_name:
+            name = block.args[changed_name[block.name]]
+            if not isinstance(name, str) or name in scope.watched:
+                return False
+        if not all(is_tight(arg) for arg in block.args if isinstance(arg, list)):
+            return False
+    return True
+
+def read_variables(block):
+    "Returns the names of the variables read by the blocks or reporters in block"
+    names = set()
+    if isinstance(block, list):
+        for b in block:
+            names |= read_variables(b)
+    elif isinstance(block, Block):
+        if block.name == "readVariable" and isinstance(block.args[0], str):
+            names.add(block.args[0])
+        for arg in block.args:
+            names |= read_variables(arg)
+    return names
+
+def changed_variables(blocks):
+    "Returns the names of the variables the blocks of a tight loop change, None if custom blocks might"
+    names = set()
+    for block in blocks or ():
+        if block.name == "call":
+            return None
+        if block.name in ("setVar:to:", "changeVar:by:"):
+            names.add(block.args[0])
+        for arg in block.args:
+            if isinstance(arg, list):
+                changed = changed_variables(arg)
+                if changed is None:
+                    return None
+                names |= changed
+    return names
+
+def repeat_iterations(block):
+    """Returns the iterations a doRepeat block runs, with those of the loops in
+    it, None if one of their counts is not a literal"""
+    count = literal_to_num(block.args[0]) if not isinstance(block.args[0], Block) else None
+    inner = loops_iterations(block.args[1])
+    if count is None or inner is None:
+        return None
+    return max(0, math.floor(count + 0.5)) * (1 + inner)
+
+def loops_iterations(blocks):
+    "Returns the iterations of the doRepeat blocks in blocks, see repeat_iterations"
+    total = 0
+    for block in blocks or ():
+        if block.name == "doRepeat":
+            iterations = repeat_iterations(block)
+        elif block.name in ("doIf", "doIfElse"):
+            iterations = loops_iterations([b for arg in block.args[1:] for b in arg or ()])
+        else:
+            continue
+        if iterations is None:
+            return None
+        total += iterations
+    return total
+
+def enter_tight_loop(block):
+    """Sets the scope for converting the body of the tight loop block, with the
+    variables it reads but does not change hoisted into locals. The outermost
+    loop of a nest decides whether their iterations are counted. Returns the
+    outer scope, to be restored afterwards, and the hoisted variables."""
+    global scope
+    outer = scope
+    depth = scope.loop_depth + 1
+    blocks = block.args[1]
+    if depth == 1:
+        iterations = repeat_iterations(block)
+        counted = not scope.atomic and (iterations is None or iterations >= tight_loop_batch)
+    else:
+        counted = scope.counted
+    changed = changed_variables(blocks)
+    names = set() if changed is None else read_variables(blocks) - changed
+    names = sorted(name for name in names if name not in scope.hoisted and var_storage(name) is not None)
+    raw = storage_attrs(names, "_{}_".format(depth))
+    num = storage_attrs(names, "_{}n_".format(depth))
+    hoisted = {name: (raw[name], num[name]) for name in names}
+    scope = scope._replace(loop_depth=depth, counted=counted, hoisted={**scope.hoisted, **hoisted})
+    return outer, hoisted
+
+def hoist_lines(hoisted):
+    "Returns the lines reading the hoisted variables into their locals"
+    lines = []
+    for name, (raw, num) in hoisted.items():
+        lines.append("{} = {}".format(raw, var_storage(name)))
+        lines.append("{} = to_num({})".format(num, raw))
+    return lines
+
+# A line of hoist_lines, reading a hoisted variable into a local
+hoisted_assignment = re.compile(r"\s*(_\d+n?_\w+) = ")
+
+def unused_hoist_lines(lines):
+    """Returns the indexes of the hoist_lines among the lines of an outermost
+    tight loop that read a variable into a local no other line uses. Reading
+    the number local of a variable uses its raw local."""
+    used = set()
+    for line in lines:
+        if not hoisted_assignment.match(line):
+            used.update(re.findall(r"\b_\d+n?_\w+", line))
+    used |= {re.sub(r"^(_\d+)n_", r"\1_", name) for name in used}
+    return {i for i, line in enumerate(lines)
+            if hoisted_assignment.match(line) and hoisted_assignment.match(line).group(1) not in used}
+
+def tight_loop_yield():
+    """Returns the end of an iteration of a tight loop: it counts the iterations
+    of all loops of the nest in _iterations and yields every tight_loop_batch of
+    them, or like loop_yield in atomic custom blocks. Afterwards the hoisted
+    variables are read again, as other scripts may have changed them."""
+    if not scope.atomic:
+        if not scope.counted:
+            return "" # the whole nest runs fewer iterations than a batch
+        count = "_iterations += 1\n"
+        condition = "not _iterations & {}".format(tight_loop_batch - 1)
+    elif scope.warp_limit is not None:
+        count = ""
+        condition = "warp_expired({!r})".format(scope.warp_limit)
+    else:
+        return ""
+    return "{}if {}:\n{}".format(count, condition, indent(4, "\n".join(["await YIELD"] + hoist_lines(scope.hoisted))))
+
+def tight_loop(block):
+    """Converts a doRepeat whose body is_tight. Instead of yielding every
+    iteration, it yields every tight_loop_batch iterations of the loops of its
+    nest, and the variables it reads but does not change are read once before it."""
+    global scope
+    count = convert_count(block.args[0])
+    outer, hoisted = enter_tight_loop(block)
+    try:
+        counter = ["_iterations = 0"] if scope.counted and scope.loop_depth == 1 else []
+        body = convert_blocks(block.args[1])
+        if scope.profile:
+            body = "count_loop()\n" + body
+        if tight_loop_yield():
+            body += "\n" + tight_loop_yield()
+    finally:
+        scope = outer
+    lines = counter + hoist_lines(hoisted) + ["for _ in range({}):".format(count)] + indent(4, body).split("\n")
+    if scope.loop_depth == 0:
+        unused = unused_hoist_lines(lines)
+        lines = [line for i, line in enumerate(lines) if i not in unused]
+    return "\n".join(lines)
+
+def until_condition(block):
+    "Returns the condition a doUntil loop runs while"
+    cond = Block("not", [block.args[0]])
+    # Optimize: eliminate "not not" expression
+    if cond.name == "not" and isinstance(cond.args[0], Block) and cond.args[0].name == "not":
+        cond = cond.args[0].args[0]
+    return cond
+
+# Blocks that await in the generated code, a custom block using them can not be a plain function
+awaiting_blocks = {"say:duration:elapsed:from:", "think:duration:elapsed:from:", "wait:elapsed:from",
+                   "wait:elapsed:from:", "doAsk", "doWaitUntil", "doBroadcastAndWait"}
+
+def awaits(blocks, sync_procs):
+    "Returns True if the blocks await, calls to the custom blocks in sync_procs do not"
+    for block in blocks:
+        if not isinstance(block, Block):
+            continue
+        if block.name in awaiting_blocks:
+            return True
+        if block.name == "call" and block.args[0] not in sync_procs:
+            return True
+        for arg in block.args:
+            if isinstance(arg, list) and awaits(arg, sync_procs):
+                return True
+            if isinstance(arg, Block) and awaits([arg], sync_procs):
+                return True
+    return False
+
+def changed_names(blocks):
+    "Returns the names of the variables and lists the blocks change, and the custom blocks they call"
+    names, calls = set(), set()
+    for block in blocks:
+        if not isinstance(block, Block):
+            continue
+        if block.name in changed_name and isinstance(block.args[changed_name[block.name]], str):
+            names.add(block.args[changed_name[block.name]])
+        if block.name == "call":
+            calls.add(block.args[0])
+        for arg in block.args:
+            if isinstance(arg, list):
+                more_names, more_calls = changed_names(arg)
+                names |= more_names
+                calls |= more_calls
+    return names, calls
+
+def sync_procedures(scripts):
+    """Returns the atomic custom blocks in scripts that can be plain functions:
+    they do not wait, and only call custom blocks that do not either. They are
+    mapped to the names of the variables and lists they change, including in
+    the custom blocks they call."""
+    procs = {hat.args.name: blocks for hat, *blocks in scripts
+             if hat.name == "procDef" and hat.args.atomic}
+    sync_procs = set(procs)
+    changed = True
+    while changed:
+        changed = False
+        for name in list(sync_procs):
+            if awaits(procs[name], sync_procs):
+                sync_procs.discard(name)
+                changed = True
+    changes = {name: changed_names(procs[name]) for name in sync_procs}
+    names = {name: set(changed) for name, (changed, _) in changes.items()}
+    changed = True
+    while changed:
+        changed = False
+        for name, (_, calls) in changes.items():
+            for call in calls:
+                if not names[call] <= names[name]:
+                    names[name] |= names[call]
+                    changed = True
+    return {name: frozenset(changed) for name, changed in names.items()}
+
+def describe(block):
+    "Returns a short description of a block, its literal arguments and ... for the others"
+    args = (repr(arg) if not isinstance(arg, (Block, list)) else "..." for arg in block.args)
+    return " ".join([block.name, *args])
 
 def convert_blocks(blocks):
-    '''Convert blocks that do not return a value'''
+    '''Convert blocks that do not return a value. The first line of the code of
+    every block gets a comment naming the script and the block, tracebacks of
+    the program show it.'''
     global unknown_block_errors
     lines = []
-    for block in blocks:
+    for block in blocks or ():
+        start = len(lines)
         if block.name == "say:duration:elapsed:from:":
             lines.append("await self.sayfor({}, {})".format(*map(convert_reporters, block.args)))
         elif block.name == "say:":
-            lines.append("await self.say({})".format(*map(convert_reporters, block.args)))
+            lines.append("self.say({})".format(*map(convert_reporters, block.args)))
         elif block.name == "think:duration:elapsed:from:":
             lines.append("await self.thinkfor({}, {})".format(*map(convert_reporters, block.args)))
         elif block.name == "think:":
-            lines.append("await self.think({})".format(*map(convert_reporters, block.args)))
+            lines.append("self.think({})".format(*map(convert_reporters, block.args)))
         elif (block.name == "wait:elapsed:from"
         or    block.name == "wait:elapsed:from:"):
-            lines.append("await asyncio.sleep({})".format(*map(convert_reporters, block.args)))
+            lines.append("await asyncio.sleep({})".format(convert_number(block.args[0])))
         elif block.name == "doAsk":
             lines.append("await self.ask({})".format(*map(convert_reporters, block.args)))
         elif block.name == "doForever":
-            lines.append("while True:\n{}\n    await asyncio.sleep(0)".format(indent(4, convert_blocks(block.args[0]))))
+            lines.append("while True:\n{}".format(loop_body(block.args[0])))
+        elif block.name == "doRepeat" and is_tight(block.args[1]):
+            lines.append(tight_loop(block))
         elif block.name == "doRepeat":
-            lines.append("for _ in range({}):\n{}\n    await asyncio.sleep(0)".format(convert_reporters(block.args[0]),
-                                                          indent(4, convert_blocks(block.args[1]))))
+            lines.append("for _ in range({}):\n{}".format(convert_count(block.args[0]),
+                                                         loop_body(block.args[1])))
         elif block.name == "doUntil":
-            body = block.args[1]
-            cond = Block("not", [block.args[0]])
-            # Optimize: eliminate "not not" expression
-            if cond.name == "not" and isinstance(cond.args[0], Block) and cond.args[0].name == "not":
-                cond = cond.args[0].args[0]
-            lines.append("while {}:\n{}\n    await asyncio.sleep(0)".format(
-                convert_reporters(cond),
-                indent(4, convert_blocks(body)) ))
+            lines.append("while {}:\n{}".format(
+                convert_reporters(until_condition(block)),
+                loop_body(block.args[1]) ))
         elif block.name == "doWaitUntil":
-            lines.append("while not {}:\n    await asyncio.sleep(0)".format(convert_reporters(block.args[0])))
+            cond = block.args[0]
+            names = condition_dependencies(cond)
+            if names is None:
+                lines.append("await wait_until(lambda: {})".format(convert_reporters(cond)))
+            else:
+                names = sorted("ANSWER" if name == ANSWER else repr(name) for name in names)
+                lines.append("await wait_until(lambda: {}, ({}{}))".format(
+                    convert_reporters(cond),
+                    ", ".join(names),
+                    "," if len(names) == 1 else ""))
         elif block.name == "setVar:to:":
-            lines.append("self.set_var({}, {})".format(*map(convert_reporters, block.args)))
+            name, value = block.args
+            storage = var_storage(name)
+            if storage is None:
+                lines.append("self.set_var({}, {})".format(*map(convert_reporters, block.args)))
+            else:
+                lines.append("{} = {}{}".format(storage, convert_reporters(value), notify(name)))
         elif block.name == "changeVar:by:":
-            lines.append("self.change_var({}, {})".format(*map(convert_reporters, block.args)))
+            name, value = block.args
+            storage = var_storage(name)
+            if storage is None:
+                lines.append("self.change_var({}, {})".format(*map(convert_reporters, block.args)))
+            else:
+                total = Block("+", [Block("readVariable", [name]), value])
+                lines.append("{} = {}{}".format(storage, convert_reporters(total), notify(name)))
         elif block.name == "call":
-            func = block.args[0].replace("%", "").replace(" ", "_")
+            func = procedure_name(block.args[0])
             args = ", ".join(map(convert_reporters, block.args[1:]))
-            lines.append("await self.{}({})".format(func, args))
+            lines.append("{}self.{}({})".format("" if block.args[0] in scope.sync_procs else "await ",
+                                                func, args))
         elif block.name == "doIfElse":
             pred = convert_reporters(block.args[0])
             if_clause, else_clause = map(convert_blocks, block.args[1:])
@@ -242,21 +954,39 @@ def convert_blocks(blocks):
             if_clause = convert_blocks(block.args[1])
             lines.append("if {}:\n{}".format(pred, indent(4, if_clause)))
         elif block.name == "append:toList:":
-            lines.append("self.add_to_list({}, {})".format(*map(convert_reporters, block.args)))
+            thing, name = block.args
+            lines.append("{}.append({}){}".format(list_storage(name), convert_reporters(thing),
+                                                  notify(name)))
         elif block.name == "deleteLine:ofList:":
-            lines.append("self.delete_stuff_from_list({}, {})".format(
-                                                      *map(convert_reporters, block.args)))
+            amount, name = block.args
+            lines.append("{}.delete({}){}".format(list_storage(name), convert_reporters(amount),
+                                                  notify(name)))
         elif block.name == "insert:at:ofList:":
-            lines.append("self.insert_thing_in_list({}, {}, {})".format(
-                                                    *map(convert_reporters, block.args)))
+            thing, place, name = block.args
+            lines.append("{}.insert({}, {}){}".format(list_storage(name),
+                                                      convert_reporters(thing),
+                                                      convert_reporters(place),
+                                                      notify(name)))
         elif block.name == "setLine:ofList:to:":
-            lines.append("self.replace_thing_in_list({}, {}, {})".format(
-                                                     *map(convert_reporters, block.args)))
+            place, name, thing = block.args
+            lines.append("{}.replace({}, {}){}".format(list_storage(name),
+                                                       convert_reporters(place),
+                                                       convert_reporters(thing),
+                                                       notify(name)))
         #
         #  Event
         #
         elif block.name == "broadcast:":
-            lines.append("broadcast({})".format(*map(convert_reporters, block.args)))
+            lines.append(broadcast_line("broadcast({})", block.args[0]))
+        elif block.name == "doBroadcastAndWait":
+            lines.append(broadcast_line("await broadcast_and_wait({})", block.args[0]))
+        #
+        #  Control
+        #
+        elif block.name == "createCloneOf":
+            lines.append("self.create_clone({})".format(*map(convert_reporters, block.args)))
+        elif block.name == "deleteClone":
+            lines.append("self.delete_clone()")
         #
         #  Sound
         #
@@ -269,8 +999,12 @@ def convert_blocks(blocks):
         #
         else:
             lines.append("UNKNOWN_block_{}({})".format(
-                block.name, ', '.join(map(convert_reporters, block.args)) ))
+                block.name.replace(':','_'), ', '.join(map(convert_reporters, block.args)) ))
             unknown_block_names.add(block.name)
+        if len(lines) > start:
+            first, newline, rest = lines[start].partition("\n")
+            description = describe(block) if scope.script is None else "{}: {}".format(scope.script, describe(block))
+            lines[start] = "{}  # {}{}{}".format(first, description, newline, rest)
     if lines:
         return "\n".join(lines)
     else:
@@ -279,19 +1013,14 @@ def convert_blocks(blocks):
 def convert_reporters(block):
     ''' Reporters are blocks that return a value '''
     global unknown_block_names
+    if isinstance(block, float) and (block != block or abs(block) == float("inf")):
+        return "float({!r})".format(repr(block)) # repr is inf or nan, which are no Python literals
     if isinstance(block, (str, int, float, bool)):
         return repr(block)
-    elif block.name in ("+", "-", "*", "/", "%"):
-        return "convert_and_run_math({}, {}, {})".format(
-                                   repr(block.name),
-                                   convert_reporters(block.args[0]),
-                                   convert_reporters(block.args[1]))
-    elif block.name in ("=", ">", "<"):
-        return "convert_and_run_comp({}, {}, {})".format(
-                                    repr(block.name),
-                                    convert_reporters(block.args[0]),
-                                    convert_reporters(block.args[1])
-        )
+    elif block.name in math_functions:
+        return convert_math(block)
+    elif block.name in comparison_functions:
+        return convert_comparison(block)
     elif block.name in ("&", "|"):
         op = {"&": "and", "|":"or"}[block.name]
         return "({} {} {})".format(convert_reporters(block.args[0]),
@@ -300,23 +1029,28 @@ def convert_reporters(block):
     elif block.name == "not":
         return "(not {})".format(convert_reporters(block.args[0]))
     elif block.name == "concatenate:with:":
-        return "(str({}) + str({}))".format(*map(convert_reporters, block.args))
+        return "(to_str({}) + to_str({}))".format(*map(convert_reporters, block.args))
     elif block.name == "answer":
         return "self.answer()"
     elif block.name == "readVariable":
-        return "self.get_var({})".format(repr(block.args[0]))
+        if block.args[0] in scope.hoisted:
+            return scope.hoisted[block.args[0]][0]
+        storage = var_storage(block.args[0])
+        if storage is None:
+            return "self.get_var({})".format(convert_reporters(block.args[0]))
+        return storage
     elif block.name == "getParam":
         return block.args[0]
     elif block.name == "contentsOfList:":
-        return "self.get_list_as_string({})".format(convert_reporters(block.args[0]))
+        return "str({})".format(list_storage(block.args[0]))
     elif block.name == "lineCountOfList:":
-        return "self.length_of_list({})".format(convert_reporters(block.args[0]))
+        return "len({})".format(list_storage(block.args[0]))
     elif block.name == "list:contains:":
-        return "self.list_contains_thing({}, {})".format(*map(convert_reporters, block.args))
+        return "{}.contains({})".format(list_storage(block.args[0]), convert_reporters(block.args[1]))
     elif block.name == "getLine:ofList:":
-        return "self.item_of_list({}, {})".format(*map(convert_reporters, block.args))
+        return "{}.item({})".format(list_storage(block.args[1]), convert_reporters(block.args[0]))
     elif block.name == "randomFrom:to:":
-        return "pick_random({}, {})".format(*map(convert_reporters, block.args))
+        return convert_random(block)
     #
     #  Sensing
     #
@@ -330,13 +1064,325 @@ def convert_reporters(block):
         unknown_block_names.add(block.name)
         return "UNKNOWN_reporter_{}({})".format(block.name.replace(':','_'), ', '.join(map(convert_reporters, block.args) ))
 
-def transpile(in_, out):
-    "Transpiles the .sb2 file found at in_ into a .py which is then written to out"
-    objects = get_stage_and_sprites(get_json(in_))
-    py = sprites_to_py(objects, out)
+def compile_project(in_, runtime="inline", profile=False, warp_limit=None, data=None):
+    """Compiles the .sb2 file found at in_ to a code object, without writing a
+    .py. Its source is registered with linecache, so tracebacks show the line of
+    every statement with the sprite, script and block it came from. data are the
+    bytes of the file, if they were read already. The other arguments are those
+    of sprites_to_py."""
+    global unknown_block_names
+    unknown_block_names = set()
+    json = get_json(in_ if data is None else io.BytesIO(data))
+    py = sprites_to_py(get_stage_and_sprites(json, lazy=True), in_, watched_names(json), None, runtime,
+                       used_subsystems(json), message_names(json), profile, warp_limit)
+    linecache.cache[in_] = (len(py), None, py.splitlines(keepends=True), in_)
+    return compile(py, in_, "exec")
+
+#
+#  In-process runs
+#
+
+# Code objects of the projects run by run_project, least recently used first
+code_cache = collections.OrderedDict()
+code_cache_size = 32
+
+def runtime_module():
+    """Returns runtime.py imported as the module programs generated with
+    runtime="import" import, the projects run in this process share it"""
+    if RUNTIME_MODULE not in sys.modules:
+        spec = importlib.util.spec_from_file_location(RUNTIME_MODULE, RUNTIME_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[RUNTIME_MODULE] = module
+    return sys.modules[RUNTIME_MODULE]
+
+def project_code(path, profile=False, warp_limit=None):
+    """Returns the code object of the .sb2 file at path, compiled by compile_project
+    to import the runtime. It is kept in code_cache by the hash of the file, so a
+    project that did not change is not read from its zip or compiled again."""
+    with open(path, "rb") as f:
+        data = f.read()
+    key = (hashlib.sha256(data).hexdigest(), profile, warp_limit)
+    if key in code_cache:
+        code_cache.move_to_end(key)
+        return code_cache[key]
+    code = compile_project(path, "import", profile, warp_limit, data)
+    code_cache[key] = code
+    while len(code_cache) > code_cache_size:
+        code_cache.popitem(last=False)
+    return code
+
+async def start_project(path, turbo=True, headless=True, profile=False, warp_limit=None, answers=None):
+    """Runs the .sb2 file at path on the running event loop until its scripts have
+    finished, and returns the namespace it ran in (project, global_vars, ...).
+    Raises the first exception a script raised, once the others finished.
+    Every project has its own Project, so many can be awaited on one loop.
+    answers are the lines ask reads before stdin, like --answers of a program."""
+    runtime_module()
+    namespace = {"__name__": "coro_scratch_project"}
+    exec(project_code(path, profile, warp_limit), namespace)
+    await namespace["run"](turbo, headless, answers)
+    return namespace
+
+def run_project(path, turbo=True, headless=True, profile=False, warp_limit=None, answers=None):
+    """Runs the .sb2 file at path in this process until its scripts have finished,
+    and returns the namespace it ran in, see start_project"""
+    return asyncio.run(start_project(path, turbo, headless, profile, warp_limit, answers))
+
+async def run_shard(paths, turbo, headless, profile, warp_limit):
+    """Runs the projects in paths concurrently on the running event loop, returns
+    the stage variables of each, or the exception it failed with"""
+    results = await asyncio.gather(*[start_project(path, turbo, headless, profile, warp_limit)
+                                     for path in paths], return_exceptions=True)
+    return [r if isinstance(r, BaseException) else dict(r["global_vars"]) for r in results]
+
+def run_shard_job(paths, turbo, headless, profile, warp_limit):
+    "Runs a shard of the projects of run_projects in a worker process"
+    return asyncio.run(run_shard(paths, turbo, headless, profile, warp_limit))
+
+def run_projects(paths, turbo=True, headless=True, profile=False, warp_limit=None, jobs=1):
+    """Runs the .sb2 files in paths concurrently on one event loop in this process
+    (jobs=1, the default), or shards them across a pool of jobs processes (one per
+    CPU if jobs is None or 0), each running its share on its own loop. Returns, in
+    the order of paths, the stage variables of every project when its scripts
+    finished, or the exception it failed with."""
+    jobs = jobs or os.cpu_count()
+    if jobs == 1:
+        return run_shard_job(paths, turbo, headless, profile, warp_limit)
+    results = [None] * len(paths)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        shards = {pool.submit(run_shard_job, paths[i::jobs], turbo, headless, profile, warp_limit): i
+                  for i in range(jobs)}
+        for future, i in shards.items():
+            results[i::jobs] = future.result()
+    return results
+
+#
+#  Transpilation cache
+#
+
+def fingerprint(value):
+    "Returns a repr of value that is the same in every run, sets and dicts are sorted"
+    if isinstance(value, (set, frozenset)):
+        return "{" + ", ".join(sorted(map(fingerprint, value))) + "}"
+    if isinstance(value, dict):
+        return "{" + ", ".join(sorted(fingerprint(k) + ": " + fingerprint(v) for k, v in value.items())) + "}"
+    if isinstance(value, (list, tuple)):
+        return type(value).__name__ + "(" + ", ".join(map(fingerprint, value)) + ")"
+    return repr(value)
+
+def default_cache_dir():
+    "Returns the directory used by --cache when no directory is given"
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "coro-scratch")
+
+class TranspileCache:
+    """On-disk cache of the generated code of scripts
+
+    Entries are keyed by a hash of the transpiler source, the blocks of the
+    script and the scope it is converted in, so they are reused as long as
+    none of them change. evict() removes the least recently used entries
+    once the cache is larger than max_size bytes."""
+    def __init__(self, path, max_size=64 * 2**20):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with open(__file__, "rb") as f:
+            self.version = hashlib.sha256(f.read()).hexdigest()
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, *parts):
+        "Returns the key for the code generated from the strings in parts"
+        digest = hashlib.sha256(self.version.encode())
+        for part in parts:
+            digest.update(b"\0" + part.encode())
+        return digest.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + ".json")
+
+    def get(self, key):
+        "Returns the entry stored under key, None if there is none"
+        filename = self._file(key)
+        try:
+            with open(filename) as f:
+                entry = json_.load(f)
+            os.utime(filename)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        "Stores entry under key"
+        filename = self._file(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Write to a file of our own first, so concurrent readers never see half an entry
+        temp = "{}.{}.tmp".format(filename, os.getpid())
+        with open(temp, "w") as f:
+            json_.dump(entry, f)
+        os.replace(temp, filename)
+
+    def evict(self):
+        "Removes the least recently used entries until the cache fits in max_size"
+        entries = []
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            self.evictions += 1
+
+    def stats(self):
+        "Returns a line with the hits, misses and evictions so far"
+        total = self.hits + self.misses
+        return "Cache: {} hits, {} misses ({:.0%} reused), {} evicted".format(
+            self.hits, self.misses, self.hits / total if total else 0, self.evictions)
+
+def transpile(in_, out, cache=None, runtime="inline", profile=False, warp_limit=None, assets=None):
+    """Transpiles the .sb2 file found at in_ into a .py which is then written to out,
+    reusing the code of unchanged scripts if a TranspileCache is given.
+    runtime, profile and warp_limit are passed on to sprites_to_py. With an assets directory the sounds and costumes are
+    extracted there, and the program plays its sounds from there. Returns the
+    names of the unsupported blocks in the project."""
+    global unknown_block_names
+    unknown_block_names = set()
+    json = get_json(in_)
+    if assets:
+        assets = os.path.abspath(assets)
+        extract_assets(in_, json, assets)
+    objects = get_stage_and_sprites(json, lazy=True)
+    py = sprites_to_py(objects, out, watched_names(json), cache, runtime, used_subsystems(json),
+                       message_names(json), profile, warp_limit, assets)
     with open(out, "w") as f:
         f.write(py)
+    return unknown_block_names
+
+#
+#  Batch mode
+#
+
+BatchResult = collections.namedtuple("BatchResult", "infile outfile seconds unknown hits misses error")
+
+def find_projects(source):
+    """Returns the .sb2 files in the directory source, or listed in the manifest
+    file source - one path per line, relative to the manifest, # starts a comment"""
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, f) for f in os.listdir(source) if f.endswith(".sb2"))
+    base = os.path.dirname(source)
+    with open(source) as f:
+        lines = [line.split("#")[0].strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line]
+
+# The cache of a batch worker process, opened once by init_worker
+worker_cache = None
+
+def init_worker(cache_dir, cache_size):
+    global worker_cache
+    if cache_dir:
+        worker_cache = TranspileCache(cache_dir, cache_size)
+
+def transpile_job(in_, out, runtime, profile, warp_limit, assets):
+    "Transpiles one project of a batch in a worker process"
+    hits, misses = (worker_cache.hits, worker_cache.misses) if worker_cache else (0, 0)
+    start = time.perf_counter()
+    try:
+        unknown, error = transpile(in_, out, worker_cache, runtime, profile, warp_limit, assets), None
+    except Exception as e:
+        unknown, error = set(), "{}: {}".format(type(e).__name__, e)
+    seconds = time.perf_counter() - start
+    if worker_cache:
+        hits, misses = worker_cache.hits - hits, worker_cache.misses - misses
+    return BatchResult(in_, out, seconds, unknown, hits, misses, error)
+
+def transpile_batch(source, out_dir, jobs=None, cache_dir=None, cache_size=64 * 2**20, runtime="inline",
+                    profile=False, warp_limit=None, assets=None):
+    """Transpiles the projects found by find_projects(source) into out_dir on a
+    pool of jobs processes, prints a report and returns the BatchResults"""
+    projects = find_projects(source)
+    os.makedirs(out_dir, exist_ok=True)
+    outfiles = [os.path.join(out_dir, os.path.splitext(os.path.basename(p))[0] + ".py") for p in projects]
+    start = time.perf_counter()
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(jobs, initializer=init_worker,
+                                                initargs=(cache_dir, cache_size)) as pool:
+        futures = [pool.submit(transpile_job, in_, out, runtime, profile, warp_limit, assets) for in_, out in zip(projects, outfiles)]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result.error:
+                print("FAILED {:>7.2f}s  {}: {}".format(result.seconds, result.infile, result.error))
+            else:
+                print("ok     {:>7.2f}s  {}".format(result.seconds, result.infile))
+    failed = [r for r in results if r.error]
+    print("Transpiled {} of {} projects in {:.2f}s".format(len(results) - len(failed), len(results),
+                                                         time.perf_counter() - start))
+    report_unknown_blocks(set().union(*[r.unknown for r in results]), "These projects use")
+    if cache_dir:
+        cache = TranspileCache(cache_dir, cache_size)
+        cache.hits = sum(r.hits for r in results)
+        cache.misses = sum(r.misses for r in results)
+        cache.evict()
+        print(cache.stats())
+    return results
 
 if __name__ == '__main__':
-    import sys
-    transpile(sys.argv[1], sys.argv[2])
+    import argparse
+    parser = argparse.ArgumentParser(description="Converts a Scratch 2.0 project to a Python program")
+    parser.add_argument("infile", nargs="?",
+                        help="the .sb2 file, or with --batch a directory of them or a manifest listing them")
+    parser.add_argument("outfile", nargs="?",
+                        help="the .py file to write, or with --batch the directory to write them to")
+    parser.add_argument("--runtime", choices=["inline", "import"], default="inline",
+                        help="paste the runtime into the program (default), or import the {} module".format(RUNTIME_MODULE))
+    parser.add_argument("--install-runtime", metavar="DIR",
+                        help="install the {} module with its bytecode into DIR".format(RUNTIME_MODULE))
+    parser.add_argument("--profile", action="store_true",
+                        help="instrument the scripts, the program prints how long each one ran when it exits")
+    parser.add_argument("--warp-limit", type=float, metavar="MS",
+                        help="let loops in atomic custom blocks yield after MS milliseconds per frame, like "
+                             "Scratch does after 500 (default: atomic custom blocks never yield)")
+    parser.add_argument("--assets", nargs="?", const=default_asset_dir(), metavar="DIR",
+                        help="extract the sounds and costumes into DIR, shared by all projects, and play "
+                             "the sounds from there (default {})".format(default_asset_dir()))
+    parser.add_argument("--batch", action="store_true",
+                        help="transpile many projects in parallel")
+    parser.add_argument("--jobs", type=int, metavar="N",
+                        help="number of processes in batch mode (default one per CPU)")
+    parser.add_argument("--cache", nargs="?", const=default_cache_dir(), metavar="DIR",
+                        help="reuse the code of unchanged scripts from DIR (default {})".format(default_cache_dir()))
+    parser.add_argument("--cache-size", type=int, default=64, metavar="MIB",
+                        help="evict the least recently used scripts when the cache is larger (default 64)")
+    args = parser.parse_args()
+    if args.install_runtime:
+        print("Installed {}".format(install_runtime(args.install_runtime)))
+        if not args.infile:
+            sys.exit(0)
+    if not args.infile or not args.outfile:
+        parser.error("infile and outfile are required")
+    warp_limit = args.warp_limit / 1000 if args.warp_limit is not None else None
+    if args.batch:
+        results = transpile_batch(args.infile, args.outfile, args.jobs, args.cache, args.cache_size * 2**20,
+                                  args.runtime, args.profile, warp_limit, args.assets)
+        sys.exit(1 if any(r.error for r in results) else 0)
+    cache = TranspileCache(args.cache, args.cache_size * 2**20) if args.cache else None
+    report_unknown_blocks(transpile(args.infile, args.outfile, cache, args.runtime, args.profile, warp_limit,
+                                    args.assets))
+    if cache:
+        cache.evict()
+        print(cache.stats())
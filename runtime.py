@@ -1,188 +1,1025 @@
-GREENFLAG = '\x11' # ASCII XON
-runtime_sprites = []
+# Runtime of the programs generated by convert.py - either pasted into every
+# program, or imported as the coro_scratch_runtime module (convert.py --runtime import)
+
+import asyncio, atexit, collections, math, os, random, sys, threading, time, traceback
+
+GREENFLAG = 0 # listener slot of the green flag, see define_messages
+CLONED = -1 # pseudo slot of the scripts a clone starts with, see create_sprite
+ANSWER = '\x06' # ASCII ACK, the name wait_until uses for the answer of ask
+
+#
+#  Scheduler
+#
+
+FRAMES_PER_SECOND = 30
+WORK_TIME = 0.75 # Part of a frame spent running scripts, like the Scratch VM
+
+class ThreadYield:
+    """Awaitable that hands control back to the scheduler, generated code
+    awaits YIELD at the end of every loop iteration"""
+    __slots__ = ()
+    def __await__(self):
+        yield self
+
+YIELD = ThreadYield()
+
+class StopScript(Exception):
+    """Ends the script running right now, from any custom block it called.
+    The Scheduler treats it like the script returning."""
+
+class WaitForChange:
+    "Awaitable that parks the script until one of the names is passed to notify_change"
+    __slots__ = ("names",)
+    def __init__(self, names):
+        self.names = names
+    def __await__(self):
+        yield self
+
+class Scheduler:
+    """Frame based round-robin of script coroutines
+
+    Every tick steps each runnable script until it awaits YIELD. Ticks are
+    repeated until the work budget of the frame is used up, then the rest of
+    the frame is slept away (or skipped in turbo mode). Scripts that await an
+    asyncio future (asyncio.sleep, ...) are parked until it is done, scripts
+    that await WaitForChange until one of its names changes, scripts that
+    await finished(script) until that script has finished. A script that
+    raises an exception stops, its traceback is printed and the others keep
+    running, the first of these exceptions is kept in error."""
+    def __init__(self, fps=FRAMES_PER_SECOND, work_time=WORK_TIME, turbo=False):
+        self.fps = fps
+        self.work_time = work_time
+        self.turbo = turbo
+        self._runnable = []
+        self._waiting = {} # script -> asyncio future it waits for
+        self._stopping = set() # stopped scripts that are stepped in this tick
+        self._wakeup = None
+        self.tick_start = 0.0
+        self.watchers = {} # name (or script, see finished) -> set of parked scripts
+        self._parked = {} # parked script -> names it waits for
+        self.error = None # the first exception a script raised
+
+    def start(self, coro):
+        "Starts a script, it runs from the next tick"
+        self._runnable.append(coro)
+        self._wake()
+
+    def _wake(self):
+        if self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    def stop(self, coro):
+        "Stops a script that has not finished yet, the script running right now stops at its next yield"
+        if coro in self._parked:
+            for name in self._parked.pop(coro):
+                self.watchers[name].discard(coro)
+                if not self.watchers[name]:
+                    del self.watchers[name]
+        elif coro in self._waiting:
+            del self._waiting[coro]
+        elif coro in self._runnable:
+            self._runnable.remove(coro)
+        else:
+            # It is running right now, or waits for its turn in this tick
+            self._stopping.add(coro)
+            return
+        coro.close()
+        self._end(coro)
+
+    def finished(self, coro):
+        "Returns an awaitable that parks the script awaiting it until the script coro has finished or was stopped"
+        return WaitForChange((coro,))
+
+    def _end(self, coro):
+        if coro in self.watchers:
+            self.notify(coro)
+
+    def _resume(self, coro):
+        if self._waiting.pop(coro, None) is None:
+            return # stopped meanwhile
+        self._runnable.append(coro)
+        self._wake()
+
+    def _stopped(self, coro):
+        if coro in self._stopping:
+            self._stopping.discard(coro)
+            coro.close()
+            self._end(coro)
+            return True
+        return False
+
+    def _step(self, coro):
+        "Runs coro to its next yield point, returns True if it should run again next tick"
+        if self._stopping and self._stopped(coro):
+            return False
+        try:
+            awaited = coro.send(None)
+        except (StopIteration, StopScript):
+            self._stopping.discard(coro)
+            self._end(coro)
+            return False
+        except Exception as e:
+            traceback.print_exc()
+            if self.error is None:
+                self.error = e
+            self._stopping.discard(coro)
+            self._end(coro)
+            return False
+        if self._stopping and self._stopped(coro):
+            return False
+        if awaited is YIELD or awaited is None:
+            return True
+        if type(awaited) is WaitForChange:
+            self._park(coro, awaited.names)
+            return False
+        # An asyncio future, the script continues when it is done
+        awaited._asyncio_future_blocking = False
+        self._waiting[coro] = awaited
+        awaited.add_done_callback(lambda _: self._resume(coro))
+        return False
+
+    def _park(self, coro, names):
+        self._parked[coro] = names
+        for name in names:
+            if name in self.watchers:
+                self.watchers[name].add(coro)
+            else:
+                self.watchers[name] = {coro}
+
+    def notify(self, name):
+        """Makes the scripts parked on name runnable again, generated code calls
+        it as notify_change when a variable or list a condition reads changes"""
+        coros = self.watchers.pop(name, None)
+        if coros is None:
+            return
+        for coro in coros:
+            for other in self._parked.pop(coro):
+                if other != name:
+                    self.watchers[other].discard(coro)
+            self._runnable.append(coro)
+        self._wake()
+
+    def warp_expired(self, limit):
+        """Returns True once the scripts of this tick ran longer than limit seconds,
+        atomic custom blocks converted with --warp-limit then yield"""
+        return time.perf_counter() - self.tick_start > limit
+
+    def tick(self):
+        "Steps every runnable script once"
+        self.tick_start = time.perf_counter()
+        runnable, self._runnable = self._runnable, []
+        for coro in runnable:
+            if self._step(coro):
+                self._runnable.append(coro)
+
+    async def run(self):
+        """Runs frames until every script has finished, or waits for a change
+        no running script can make"""
+        loop = asyncio.get_running_loop()
+        while self._runnable or self._waiting:
+            if not self._runnable:
+                self._wakeup = loop.create_future()
+                await self._wakeup
+                self._wakeup = None
+                continue
+            frame = 1 / self.fps
+            start = loop.time()
+            deadline = start + frame * self.work_time
+            while self._runnable:
+                self.tick()
+                if loop.time() >= deadline:
+                    break
+            if self.turbo:
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(max(0, start + frame - loop.time()))
+
+async def wait_until(condition, names=None):
+    """Waits until condition() is true
+
+    The condition is evaluated again when one of the variables or lists in
+    names changes. If names is None it is polled every tick instead."""
+    if names is None:
+        while not condition():
+            await YIELD
+    else:
+        while not condition():
+            await WaitForChange(names)
+
+#
+#  Profiler, used by programs converted with --profile
+#
+
+class ScriptStats:
+    "What the profiler counted for one script or custom block"
+    __slots__ = ("activations", "total_time", "self_time", "yields", "loops", "depth")
+
+    def __init__(self):
+        self.activations = 0
+        self.total_time = 0.0 # seconds running, including the custom blocks it called
+        self.self_time = 0.0 # seconds running, without the profiled custom blocks it called
+        self.yields = 0
+        self.loops = 0
+        self.depth = 0 # steps of the script that are running, more than one when it recursed
+
+profile_stack = [] # [ScriptStats, seconds spent in profiled callees] of the running steps
+
+def profile_enter(stats):
+    "Starts timing a step of the script stats belongs to, returns its start time"
+    profile_stack.append([stats, 0.0])
+    stats.depth += 1
+    return time.perf_counter()
+
+def profile_leave(start):
+    "Stops timing the innermost step"
+    elapsed = time.perf_counter() - start
+    stats, callees = profile_stack.pop()
+    stats.depth -= 1
+    if not stats.depth:
+        stats.total_time += elapsed
+    stats.self_time += elapsed - callees
+    if profile_stack:
+        profile_stack[-1][1] += elapsed
+
+class ProfiledCoroutine:
+    "Runs a script coroutine while timing each of its steps"
+    __slots__ = ("coro", "stats")
+
+    def __init__(self, coro, stats):
+        self.coro = coro
+        self.stats = stats
+
+    def __await__(self):
+        coro, stats = self.coro, self.stats
+        stats.activations += 1
+        value = error = None
+        while True:
+            start = profile_enter(stats)
+            try:
+                awaited = coro.send(value) if error is None else coro.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                profile_leave(start)
+            stats.yields += 1
+            try:
+                value, error = (yield awaited), None
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
+
+def profile_script(profile_stats, sprite, script):
+    """Method decorator that counts the activations, time, yields and loop
+    iterations of a script in profile_stats, see Project.profiled"""
+    def decorator(fn):
+        stats = profile_stats[sprite, script] = ScriptStats()
+        if asyncio.iscoroutinefunction(fn):
+            async def wrapper(*args):
+                return await ProfiledCoroutine(fn(*args), stats)
+        else:
+            # An atomic custom block compiled to a plain function
+            def wrapper(*args):
+                stats.activations += 1
+                start = profile_enter(stats)
+                try:
+                    return fn(*args)
+                finally:
+                    profile_leave(start)
+        wrapper.__name__ = fn.__name__
+        return wrapper
+    return decorator
+
+def count_loop():
+    "Counts an iteration of a loop in the script running right now"
+    profile_stack[-1][0].loops += 1
+
+def print_profile(profile_stats, file=None):
+    "Prints the profile of every script in profile_stats, the slowest first"
+    file = file or sys.stderr
+    print("{:<16} {:<20} {:>8} {:>10} {:>10} {:>8} {:>10}".format(
+          "sprite", "script", "calls", "total ms", "self ms", "yields", "loops"), file=file)
+    for (sprite, script), stats in sorted(profile_stats.items(), key=lambda item: -item[1].total_time):
+        print("{:<16} {:<20} {:>8} {:>10.2f} {:>10.2f} {:>8} {:>10}".format(
+              sprite, script, stats.activations, stats.total_time * 1000, stats.self_time * 1000,
+              stats.yields, stats.loops), file=file)
 
 #
 #  Broadcast mechanism
 #
 
-event_listener = {}
+class Receiver:
+    "A script started by a message, it is restarted when the message is broadcast again"
+    __slots__ = ("script", "scheduler", "slot", "coro")
+
+    def __init__(self, script, scheduler, slot):
+        self.script = script
+        self.scheduler = scheduler
+        self.slot = slot
+        self.coro = None
 
-def add_listener(event_name, fn):
-    '''Register a callback for the specified event'''
-    if not event_name in event_listener:
-        event_listener[event_name] = []
-    event_listener[event_name].append(fn)
+    def running(self):
+        return self.coro is not None and self.coro.cr_frame is not None
 
-def broadcast(event_name):
-    '''Signal all functions that wait for the event'''
-    if not event_name in event_listener:
-        return
-    for fn in event_listener[event_name]:
-        asyncio.create_task(fn())
+    def restart(self):
+        if self.running():
+            self.scheduler.stop(self.coro)
+        self.coro = self.script()
+        self.scheduler.start(self.coro)
 
-def on_broadcast(event_name):
-    '''Method decorator that trigger function when event occurs'''
+def on_broadcast(slot):
+    '''Method decorator that trigger function when the message in slot is broadcast'''
     def decorator(fn):
         # custom attribute, picked up by create_sprite
-        fn.trigger_event = event_name
+        fn.trigger_event = slot
         return fn
     return decorator
 
 #
-#  Events
+#  Backends
 #
 
-key_dictionary = {
-    "backspace" : pygame.K_BACKSPACE,
-    "return" : pygame.K_RETURN,
-    "escape" : pygame.K_ESCAPE,
-    "space" : pygame.K_SPACE,
-    "up arrow" : pygame.K_UP,
-    "down arrow" : pygame.K_DOWN,
-    "right arrow" : pygame.K_RIGHT,
-    "left arrow" : pygame.K_LEFT,
-}
+class Answers:
+    """The answers to ask: the scripted answers if there are any, then the lines
+    of stdin. A thread reads stdin and hands the lines to the event loop, so
+    waiting for one does not stop the other scripts. command is called with
+    every line first, the lines it returns True for are no answers."""
+    def __init__(self, scripted=None, command=None):
+        self.lines = collections.deque(scripted or ()) # None marks the end of the input
+        self.command = command
+        self.loop = None # the loop of the reader thread, once it was started
+        self.waiter = None # future of the read waiting for a line
+
+    def start(self):
+        "Starts reading stdin in the background, must be called on the event loop"
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            threading.Thread(target=self._read_stdin, daemon=True).start()
+
+    def _read_stdin(self):
+        try:
+            for line in sys.stdin:
+                line = line.rstrip("\n")
+                if self.command is None or not self.command(line):
+                    self.loop.call_soon_threadsafe(self._add, line)
+            self.loop.call_soon_threadsafe(self._add, None)
+        except RuntimeError:
+            pass # the loop was closed, the project has finished
+
+    def _add(self, line):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(line)
+        else:
+            self.lines.append(line)
+
+    async def read(self):
+        "Returns the next answer, raises EOFError at the end of the input"
+        if not self.lines:
+            self.start()
+        if self.lines:
+            line = self.lines.popleft()
+        elif self.waiter is not None:
+            raise RuntimeError("another read is waiting for the next answer")
+        else:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                line = await self.waiter
+            finally:
+                self.waiter = None
+        if line is None:
+            self.lines.appendleft(None)
+            raise EOFError
+        return line
+
+def read_answers(argv):
+    "Returns the lines of the file after --answers in argv, the scripted answers of a program, or None"
+    if "--answers" not in argv:
+        return None
+    with open(argv[argv.index("--answers") + 1]) as f:
+        return f.read().splitlines()
+
+class HeadlessBackend:
+    """Runs without pygame: keys are pressed and released by "press <key>" and
+    "release <key>" lines on stdin, sounds are not played. answers are the
+    scripted answers to ask, see Answers."""
+    def __init__(self, answers=None):
+        self.pressed = set()
+        self.answers = Answers(answers, self._command)
+
+    def _command(self, line):
+        command, _, key = line.partition(" ")
+        if command == "press":
+            self.pressed.add(key)
+        elif command == "release":
+            self.pressed.discard(key)
+        else:
+            return False
+        return True
+
+    def key_pressed(self, key):
+        # Only read stdin in the background once the project looks at the keys
+        self.answers.start()
+        return key in self.pressed
 
-def key_pressed(key):
-    if pygame.key.get_pressed()[key_dictionary[key]]: return True
-    else: return False
+    def preload(self, filenames):
+        pass
+
+    def play_sound(self, filename):
+        pass
+
+    def stop_all_sounds(self):
+        pass
+
+class PygameBackend:
+    "Reads the keys of a pygame window and plays sounds with pygame.mixer"
+    key_names = {
+        "backspace" : "K_BACKSPACE",
+        "return" : "K_RETURN",
+        "escape" : "K_ESCAPE",
+        "space" : "K_SPACE",
+        "up arrow" : "K_UP",
+        "down arrow" : "K_DOWN",
+        "right arrow" : "K_RIGHT",
+        "left arrow" : "K_LEFT",
+    }
+
+    def __init__(self, subsystems, answers=None):
+        import pygame
+        self.pygame = pygame
+        self.answers = Answers(answers)
+        self.keys = {name: getattr(pygame, const) for name, const in self.key_names.items()}
+        self.loaded_sounds = {} # filename -> pygame.mixer.Sound
+        self.audio = "audio" in subsystems
+        if "keys" in subsystems:
+            pygame.display.init()
+            pygame.display.set_mode((480, 360))
+        if "audio" in subsystems:
+            pygame.mixer.init()
+
+    def key_pressed(self, key):
+        self.pygame.event.pump()
+        return bool(self.pygame.key.get_pressed()[self.keys[key]])
+
+    def _load_sounds(self, filenames):
+        for filename in filenames:
+            if filename not in self.loaded_sounds:
+                try:
+                    self.loaded_sounds[filename] = self.pygame.mixer.Sound(filename)
+                except (self.pygame.error, OSError):
+                    pass # play_sound raises the error when the project plays it
+
+    def preload(self, filenames):
+        "Decodes the sounds in filenames in the background, so playing them first does not wait"
+        if self.audio:
+            threading.Thread(target=self._load_sounds, args=(list(filenames),), daemon=True).start()
+
+    def play_sound(self, filename):
+        if filename not in self.loaded_sounds:
+            self.loaded_sounds[filename] = self.pygame.mixer.Sound(filename)
+        self.loaded_sounds[filename].play()
+
+    def stop_all_sounds(self):
+        self.pygame.mixer.stop()
 
 #
-#  Stage and Sprite base classes
+#  Projects
 #
 
-def create_sprite(cls):
-    """Class decorator that registers the sprite - every Scratch sprite is a singleton"""
-    sprite = cls()
-    runtime_sprites.append(sprite)
-    runtime_greenflags.extend(sprite._greenflags)
+class Project:
+    """The state of one project: its scheduler, stage variables and lists,
+    sprites, broadcasts, backend and profile
+
+    A generated program makes one and binds the names its code uses to it
+    (see names), so the runtime has no state of its own and any number of
+    projects can share it and run on one event loop."""
+    max_clones = 300 # like Scratch, creating more clones does nothing
+
+    def __init__(self):
+        self.scheduler = Scheduler()
+        self.global_vars = {}
+        self.global_lists = {}
+        self.sprites = []
+        self.sprite_names = {} # objName -> sprite
+        self.clones = {} # clone -> the Receivers of its scripts
+        self.message_slots = {} # message name -> listener slot
+        # listener slot -> Receivers (a dict used as an ordered set, clones remove theirs),
+        # slot 0 is the green flag
+        self.listeners = [{}]
+        self.backend = HeadlessBackend()
+        self.profile_stats = {} # (sprite name, script name) -> ScriptStats
+        self.assets = None # directory of the sounds and costumes, set by programs converted with --assets
+        self.answer = "" # the answer to the last question, of any sprite
+        self.asking = None # future that is done when the last question asked is answered
+
+    def names(self):
+        "Returns the global names of generated code that belong to this project"
+        return {
+            "scheduler": self.scheduler,
+            "global_vars": self.global_vars,
+            "global_lists": self.global_lists,
+            "notify_change": self.scheduler.notify,
+            "warp_expired": self.scheduler.warp_expired,
+            "define_messages": self.define_messages,
+            "message_slot": self.message_slot,
+            "broadcast": self.broadcast,
+            "broadcast_and_wait": self.broadcast_and_wait,
+            "create_sprite": self.create_sprite,
+            "use_backend": self.use_backend,
+            "key_pressed": self.key_pressed,
+            "stop_all_sounds": self.stop_all_sounds,
+            "profiled": self.profiled,
+            "enable_profile": self.enable_profile,
+        }
+
+    async def run(self, turbo=False):
+        """Clicks the green flag and runs frames until every script has finished,
+        then raises the first exception a script raised, if any"""
+        self.scheduler.turbo = turbo
+        self.broadcast(GREENFLAG)
+        await self.scheduler.run()
+        if self.scheduler.error is not None:
+            raise self.scheduler.error
+
+    # Broadcasts
+    def define_messages(self, names):
+        "Gives the messages of the project the listener slots after the green flag, in order"
+        for name in names:
+            self.message_slots[name] = len(self.listeners)
+            self.listeners.append({})
+
+    def message_slot(self, name):
+        "Returns the listener slot of a message computed at runtime, None if nothing receives it"
+        return self.message_slots.get(to_str(name))
+
+    def add_listener(self, slot, fn):
+        '''Register a callback for the message in slot, returns its Receiver'''
+        receiver = Receiver(fn, self.scheduler, slot)
+        self.listeners[slot][receiver] = None
+        return receiver
+
+    def broadcast(self, slot):
+        '''Starts the scripts that receive the message in slot, restarting those still running'''
+        if slot is None:
+            return ()
+        receivers = self.listeners[slot]
+        for receiver in receivers:
+            receiver.restart()
+        return receivers
+
+    async def broadcast_and_wait(self, slot):
+        "Broadcasts the message in slot, then waits until the scripts receiving it have finished"
+        for receiver in list(self.broadcast(slot)):
+            # A receiver restarted meanwhile runs a new coroutine, wait for that too
+            while receiver.running():
+                await self.scheduler.finished(receiver.coro)
+
+    # Sprites and clones
+    def create_sprite(self, cls):
+        """Class decorator that registers the sprite - the original of every
+        Scratch sprite is a singleton, further instances are its clones"""
+        cls.project = self
+        # The methods marked with on_broadcast, clones start theirs from this table
+        cls.scripts = [(method.trigger_event, method) for method in cls.__dict__.values()
+                       if hasattr(method, "trigger_event")]
+        cls.sound_files = dict(cls.my_sounds)
+        sprite = cls()
+        self.sprites.append(sprite)
+        self.sprite_names[cls.my_attr.get("objName")] = sprite
+        for slot, method in cls.scripts:
+            if slot != CLONED:
+                self.add_listener(slot, method.__get__(sprite))
+        return cls
 
-    # Set up callbacks for methods marked with on_broadcast
-    for name, method in cls.__dict__.items():
-        if hasattr(method, "trigger_event"):
-            def singleton_fn():
-                return method(sprite)
-            add_listener(method.trigger_event, singleton_fn)
+    def create_clone(self, sprite):
+        """Clones sprite and starts the scripts of the clone that run when it
+        is created, its other scripts receive broadcasts like the original's"""
+        if len(self.clones) >= self.max_clones:
+            return
+        clone = sprite.clone()
+        receivers = self.clones[clone] = []
+        for slot, method in type(sprite).scripts:
+            if slot == CLONED:
+                receiver = Receiver(method.__get__(clone), self.scheduler, slot)
+                receiver.restart()
+            elif slot != GREENFLAG:
+                receiver = self.add_listener(slot, method.__get__(clone))
+            else:
+                continue
+            receivers.append(receiver)
+
+    def delete_clone(self, clone):
+        "Stops the scripts of clone and forgets it, returns False if it is no clone"
+        receivers = self.clones.pop(clone, None)
+        if receivers is None:
+            return False
+        for receiver in receivers:
+            if receiver.slot != CLONED:
+                del self.listeners[receiver.slot][receiver]
+            if receiver.running():
+                self.scheduler.stop(receiver.coro)
+        return True
+
+    # Backend
+    def use_backend(self, subsystems, headless=False, answers=None):
+        """Uses pygame if the project needs one of its subsystems ("keys", "audio"),
+        pygame is only imported then. headless forces the headless backend.
+        answers are scripted answers to ask, read before stdin."""
+        if headless or not subsystems:
+            self.backend = HeadlessBackend(answers)
+        else:
+            self.backend = PygameBackend(subsystems, answers)
+        self.backend.preload({self.asset_path(md5) for sprite in self.sprites for _, md5 in sprite.my_sounds})
+
+    def asset_path(self, md5):
+        "Returns the file of the sound or costume named md5, in the working directory without assets"
+        return md5 if self.assets is None else os.path.join(self.assets, md5)
+
+    async def ask(self, sprite, question):
+        """Asks question for the sprite named sprite once the questions asked
+        before are answered, like Scratch shows one at a time"""
+        turn = self.asking
+        done = self.asking = asyncio.get_running_loop().create_future()
+        try:
+            if turn is not None:
+                await turn
+            print("{} asks '{}'".format(sprite, question))
+            self.answer = await self.backend.answers.read()
+            await YIELD # like in Scratch, the script continues in the next tick
+        finally:
+            if turn is not None and not turn.done():
+                # Stopped while waiting, the next question still waits for the one before
+                turn.add_done_callback(lambda _: self._answered(done))
+            else:
+                self._answered(done)
+        self.scheduler.notify(ANSWER)
+
+    def _answered(self, done):
+        "Lets the next question be asked, done is the future of the one answered"
+        done.set_result(None)
+        if self.asking is done:
+            self.asking = None
+
+    def key_pressed(self, key):
+        return self.backend.key_pressed(key)
+
+    def stop_all_sounds(self):
+        self.backend.stop_all_sounds()
+
+    # Profiler
+    def profiled(self, sprite, script):
+        "Method decorator that profiles a script of this project"
+        return profile_script(self.profile_stats, sprite, script)
+
+    def enable_profile(self):
+        "Prints the profile when the program exits, also when it is interrupted"
+        atexit.register(print_profile, self.profile_stats)
+
+#
+#  Stage and Sprite base classes
+#
 
 class runtime_Stage:
+    # Generated classes add the attributes of their variables and lists to
+    # __slots__, so a clone only takes the memory of its values
+    __slots__ = ("_vars", "_lists")
+    project = None # the Project, set by Project.create_sprite
+    scripts = [] # (listener slot, method) of the scripts, set by Project.create_sprite
+    sound_files = {} # name -> md5 file name of the sounds, set by Project.create_sprite
+    # Attributes the transpiler bound variables and lists to, name -> attribute
+    var_attrs = {}
+    list_attrs = {}
+
     def __init__(self):
-        scripts = [(script, getattr(self, script)) for script in dir(self) if callable(getattr(self, script))]
-        self._greenflags = [script for name, script in scripts if name.startswith("greenflag")]
-        self._answer = ""
         self._vars = dict(self.my_vars)
-        self._lists = dict(self.my_lists)
+        for name, attr in self.var_attrs.items():
+            setattr(self, attr, self._vars.pop(name))
+        self._lists = {name: ScratchList(contents) for name, contents in self.my_lists}
+        for name, attr in self.list_attrs.items():
+            setattr(self, attr, self._lists.pop(name))
 
     async def ask(self, question):
-        "Asks question"
-        print("{} asks '{}'".format(self.__class__.__name__, question))
-        self._answer = input()
+        "Asks question and waits for the answer"
+        await self.project.ask(self.__class__.__name__, question)
 
     def answer(self):
         "Returns the answer"
-        return self._answer
+        return self.project.answer
+
+    def find_sound(self, sound):
+        """Returns the file name of the sound named sound, else of the sound
+        numbered sound (from 1, wrapping around like Scratch), None if there is
+        neither"""
+        filename = self.sound_files.get(to_str(sound))
+        if filename is None and self.my_sounds:
+            number, is_number = convert_to_num(sound)
+            if is_number and math.isfinite(number):
+                filename = self.my_sounds[(math.floor(number + 0.5) - 1) % len(self.my_sounds)][1]
+        return filename
+
+    def play_sound(self, sound):
+        "Starts playing the sound named or numbered sound, unknown sounds are ignored"
+        filename = self.find_sound(sound)
+        if filename is not None:
+            self.project.backend.play_sound(self.project.asset_path(filename))
+
+    def create_clone(self, name):
+        "Creates a clone of the sprite named name, or of this sprite if name is _myself_"
+        sprite = self if name == "_myself_" else self.project.sprite_names.get(to_str(name))
+        if isinstance(sprite, runtime_Sprite):
+            self.project.create_clone(sprite)
+
+    # Access by name, for variables and lists the transpiler could not bind
     def set_var(self, var, value):
         "Sets var to value"
+        global_vars = self.project.global_vars
         if var in global_vars:
             global_vars[var] = value
+        elif var in self.var_attrs:
+            setattr(self, self.var_attrs[var], value)
         else:
             self._vars[var] = value
+        self.project.scheduler.notify(var)
     def change_var(self, var, value):
         "Sets var to value"
-        if var in global_vars:
-            global_vars[var] = convert_and_run_math("+", global_vars[var], value)
-        else:
-            self._vars[var] = convert_and_run_math("+", self._vars[var], value)
+        self.set_var(var, math_add(self.get_var(var), value))
     def get_var(self, var):
         "Return the value of var"
+        global_vars = self.project.global_vars
         if var in global_vars:
             return global_vars[var]
+        elif var in self.var_attrs:
+            return getattr(self, self.var_attrs[var])
         elif var in self._vars:
             return self._vars[var]
         return 0
     def _get_list(self, listName):
         "Returns the list listName"
+        global_lists = self.project.global_lists
         if listName in global_lists:
             return global_lists[listName]
+        elif listName in self.list_attrs:
+            return getattr(self, self.list_attrs[listName])
         elif listName in self._lists:
             return self._lists[listName]
         else:
-            self._lists[listName] = []
+            self._lists[listName] = ScratchList()
             return self._lists[listName]
-    def get_list_as_string(self, listName):
-        l = self._get_list(listName)
-        if all([len(item) <= 1 for item in l]):
-            return "".join(map(str, l))
-        else:
-            return " ".join(map(str, l))
-    def add_to_list(self, thing, listName):
-        self._get_list(listName).append(str(thing))
-    def insert_thing_in_list(self, thing, place, listName):
-        l = self._get_list(listName)
-        if place == "last":
-            l.append(thing)
-        elif place == "random":
-            l.insert(random.randrange(0, len(l)), thing)
-        else:
-            l.insert(int(convert_to_num(place)[0])-1, thing)
-    def replace_thing_in_list(self, place, listName, thing):
-        l = self._get_list(listName)
-        if place == "last":
-            l[-1] = thing
-        elif place == "random":
-            l[random.randrange(0, len(l))] = thing
-        else:
-            l[int(convert_to_num(place)[0])-1] = thing
-    def delete_stuff_from_list(self, amount, listName):
-        l = self._get_list(listName)
-        if amount == "all":
-            l.clear()
-        elif amount == "last":
-            del l[-1]
-        else:
-            del l[int(convert_to_num(amount)[0])-1]
-    def length_of_list(self, listName):
-        return len(self._get_list(listName))
-    def list_contains_thing(self, listName, thing):
-        return str(thing).lower() in [str(item).lower()
-                                      for item in self._get_list(listName)]
-    def item_of_list(self, place, listName):
-        l = self._get_list(listName)
-        if place == "last":
-            return l[-1]
-        elif place == "random":
-            return random.choice(l)
+
+#
+#  Lists
+#
+
+class ScratchList:
+    """A Scratch list
+
+    Keeps count of the lowercase text of its items, so contains is a dict
+    lookup, and caches the text of the list until the next change. Places
+    are 1-based numbers, "last" or "random" like in Scratch."""
+    __slots__ = ("items", "_counts", "_text")
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        self._counts = {}
+        for item in self.items:
+            self._add_key(item)
+        self._text = None
+
+    def _add_key(self, item):
+        key = to_str(item).lower()
+        self._counts[key] = self._counts.get(key, 0) + 1
+
+    def _remove_key(self, item):
+        key = to_str(item).lower()
+        if self._counts[key] == 1:
+            del self._counts[key]
         else:
-            return l[int(convert_to_num(place)[0])-1]
+            self._counts[key] -= 1
 
-def convert_to_num(n):
-    "Converts a number string to a Python number"
-    if isinstance(n, (int, float)):
-        return (n, True)
+    def _index(self, place, length):
+        "Returns the index for place, None if it is outside 0..length-1"
+        if type(place) is not int:
+            if place == "last":
+                place = length
+            elif place == "random" or place == "any":
+                if length == 0:
+                    return None
+                return random.randrange(length)
+            else:
+                try:
+                    place = int(to_num(place))
+                except (ValueError, OverflowError):
+                    return None
+        if 1 <= place <= length:
+            return place - 1
+        return None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __repr__(self):
+        return "ScratchList({!r})".format(self.items)
+
+    def __str__(self):
+        "The contents of the list the way Scratch shows them"
+        if self._text is None:
+            items = [to_str(item) for item in self.items]
+            if all(len(item) <= 1 for item in items):
+                self._text = "".join(items)
+            else:
+                self._text = " ".join(items)
+        return self._text
+
+    def append(self, thing):
+        thing = to_str(thing)
+        self.items.append(thing)
+        self._add_key(thing)
+        self._text = None
+
+    def insert(self, thing, place):
+        index = self._index(place, len(self.items) + 1)
+        if index is None:
+            return
+        self.items.insert(index, thing)
+        self._add_key(thing)
+        self._text = None
+
+    def replace(self, place, thing):
+        index = self._index(place, len(self.items))
+        if index is None:
+            return
+        self._remove_key(self.items[index])
+        self.items[index] = thing
+        self._add_key(thing)
+        self._text = None
+
+    def delete(self, place):
+        if place == "all":
+            self.items.clear()
+            self._counts.clear()
+            self._text = None
+            return
+        index = self._index(place, len(self.items))
+        if index is None:
+            return
+        self._remove_key(self.items.pop(index))
+        self._text = None
+
+    def contains(self, thing):
+        return to_str(thing).lower() in self._counts
+
+    def item(self, place):
+        index = self._index(place, len(self.items))
+        if index is None:
+            return ""
+        return self.items[index]
+
+#
+#  Operators
+#
+
+_INF = float("inf")
+_NAN = float("nan")
+
+# Parsed strings, so literals and variables compared/added in loops are only parsed once
+_num_cache = {}
+
+def _parse_num(s):
+    "Parses s the way Scratch's Number() does, returns (number, is_number)"
+    s = s.strip()
+    if s == "" or "_" in s:
+        return 0, False
     try:
-        return int(n), True
+        return int(s), True
     except ValueError:
+        pass
+    if s[:2] in ("0x", "0X"):
         try:
-            return int(n, base=16), True
+            return int(s, base=16), True
         except ValueError:
-            try:
-                return float(n), True
-            except ValueError:
-                return 0, False
+            return 0, False
+    if s in ("Infinity", "+Infinity"):
+        return _INF, True
+    if s == "-Infinity":
+        return -_INF, True
+    if s.lstrip("+-")[:1].isalpha():
+        # float() would accept "inf" and "nan", Scratch does not
+        return 0, False
+    try:
+        return float(s), True
+    except ValueError:
+        return 0, False
 
-def convert_and_run_math(op, a, b):
-    num_a, _ = convert_to_num(a)
-    num_b, _ = convert_to_num(b)
-    return eval("{} {} {}".format(num_a, op, num_b))
+def convert_to_num(n):
+    "Converts a number string to a Python number"
+    t = type(n)
+    if t is int or t is float:
+        return (n, True)
+    if t is bool:
+        return (int(n), True)
+    if t is not str:
+        n = str(n)
+    try:
+        return _num_cache[n]
+    except KeyError:
+        result = _num_cache[n] = _parse_num(n)
+        if len(_num_cache) > 4096:
+            _num_cache.clear()
+        return result
 
-def convert_and_run_comp(op, a, b):
-    if op == "=":
-        op = "=="
+def to_num(n):
+    "Converts n to a number, anything that is not a number becomes 0"
+    t = type(n)
+    if t is int or t is float:
+        return n
+    return convert_to_num(n)[0]
+
+def repeat_count(n):
+    """Converts the count of a repeat loop like Scratch: rounded (halves up, like
+    Math.round) and clipped to 0 .. 2**31 - 1, NaN is 0"""
+    n = to_num(n)
+    if n != n:
+        return 0
+    return math.floor(max(0, min(n, 2**31 - 1)) + 0.5)
+
+def to_str(thing):
+    "Converts thing to the string Scratch would display"
+    t = type(thing)
+    if t is str:
+        return thing
+    if t is bool:
+        return "true" if thing else "false"
+    if t is float:
+        if thing != thing:
+            return "NaN"
+        if thing in (_INF, -_INF):
+            return "Infinity" if thing > 0 else "-Infinity"
+        if thing.is_integer() and abs(thing) < 1e21:
+            return str(int(thing))
+    return str(thing)
+
+def math_add(a, b):
+    return to_num(a) + to_num(b)
+
+def math_sub(a, b):
+    return to_num(a) - to_num(b)
+
+def math_mul(a, b):
+    return to_num(a) * to_num(b)
+
+def math_div(a, b):
+    a, b = to_num(a), to_num(b)
+    if b == 0:
+        if a == 0 or a != a:
+            return _NAN
+        return _INF if a > 0 else -_INF
+    return a / b
+
+def math_mod(a, b):
+    a, b = to_num(a), to_num(b)
+    if b == 0:
+        return _NAN
+    return a % b
+
+def _compare(a, b):
+    "Returns -1, 0 or 1 - numbers compare as numbers, everything else case-insensitively as text"
     num_a, a_is_num = convert_to_num(a)
     num_b, b_is_num = convert_to_num(b)
     if not a_is_num or not b_is_num:
-        return eval("{} {} {}".format(repr(str(a)), op, repr(str(b))))
-    else:
-        return eval("{} {} {}".format(num_a, op, num_b))
+        num_a, num_b = to_str(a).lower(), to_str(b).lower()
+    return (num_a > num_b) - (num_a < num_b)
+
+def comp_eq(a, b):
+    ta, tb = type(a), type(b)
+    if (ta is int or ta is float) and (tb is int or tb is float):
+        return a == b
+    return _compare(a, b) == 0
+
+def comp_lt(a, b):
+    ta, tb = type(a), type(b)
+    if (ta is int or ta is float) and (tb is int or tb is float):
+        return a < b
+    return _compare(a, b) < 0
+
+def comp_gt(a, b):
+    ta, tb = type(a), type(b)
+    if (ta is int or ta is float) and (tb is int or tb is float):
+        return a > b
+    return _compare(a, b) > 0
+
+# Dispatch tables from Scratch operator to implementation
+math_operators = {"+": math_add, "-": math_sub, "*": math_mul, "/": math_div, "%": math_mod}
+comparison_operators = {"=": comp_eq, "<": comp_lt, ">": comp_gt}
+
+def convert_and_run_math(op, a, b):
+    return math_operators[op](a, b)
+
+def convert_and_run_comp(op, a, b):
+    return comparison_operators[op](a, b)
+
 def pick_random(a, b):
     a, b = map(convert_to_num, (a, b))
     a, b = a[0], b[0]
@@ -192,30 +1029,41 @@ def pick_random(a, b):
         return random.randint(a, b)
 
 #
-#  Audio
+#  Sprite base class
 #
 
-loaded_sounds = {}
-def play_sound(filename):
-    if not filename in loaded_sounds:
-        loaded_sounds[filename] = pygame.mixer.Sound(filename)
-    loaded_sound[filename].play()
+class runtime_Sprite(runtime_Stage):
+    __slots__ = ()
 
-def stop_all_sounds():
-    pygame.mixer.stop()
+    def clone(self):
+        "Returns a new instance with copies of the variables and lists of this one"
+        cls = type(self)
+        clone = cls.__new__(cls)
+        clone._vars = dict(self._vars)
+        clone._lists = {name: ScratchList(l.items) for name, l in self._lists.items()}
+        for attr in self.var_attrs.values():
+            setattr(clone, attr, getattr(self, attr))
+        for attr in self.list_attrs.values():
+            setattr(clone, attr, ScratchList(getattr(self, attr).items))
+        return clone
+
+    def delete_clone(self):
+        """Deletes this sprite if it is a clone, its scripts stop, the one
+        running right now too (by raising StopScript)"""
+        if self.project.delete_clone(self):
+            raise StopScript
 
-class runtime_Sprite(runtime_Stage):
     async def sayfor(self, thing, time):
         "Says thing for time seconds"
-        print("{} says '{}'".format(self.__class__.__name__, thing))
+        print("{} says '{}'".format(self.__class__.__name__, to_str(thing)))
         await asyncio.sleep(time)
-    async def say(self, thing):
+    def say(self, thing):
         "Says thing"
-        print("{} says '{}'".format(self.__class__.__name__, thing))
+        print("{} says '{}'".format(self.__class__.__name__, to_str(thing)))
     async def thinkfor(self, thing, time):
         "Thinks thing for time seconds"
-        print("{} thinks '{}'".format(self.__class__.__name__, thing))
+        print("{} thinks '{}'".format(self.__class__.__name__, to_str(thing)))
         await asyncio.sleep(time)
-    async def think(self, thing):
+    def think(self, thing):
         "Thinks thing"
-        print("{} thinks '{}'".format(self.__class__.__name__, thing))
+        print("{} thinks '{}'".format(self.__class__.__name__, to_str(thing)))